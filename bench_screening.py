@@ -0,0 +1,196 @@
+#Benchmarks for the pair-screening funnel of pair_trading.py on synthetic price panels
+#
+#Each case is one sector of n names over a number of days, with a share of the names built as
+#mean-reverting partners of another name so every stage of the cascade has survivors to work on.
+#Stages are timed (median of --repeat runs) and re-run once under tracemalloc for peak memory.
+#
+#   python bench_screening.py                     quick cases, print the table
+#   python bench_screening.py --full              20..500 names x 250..2000 days
+#   python bench_screening.py --save-baseline     store results in bench_baseline.json
+#   python bench_screening.py --check             exit 1 if a stage is slower than baseline * tolerance
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import quantopian_local
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+QUICK_CASES = [(20, 250), (20, 730), (50, 730), (100, 730)]
+FULL_CASES = [(names, days) for names in (20, 50, 100, 250, 500) for days in (250, 730, 2000)]
+#per-spread tests are timed on at most this many candidate spreads
+SPREAD_SAMPLE = 200
+
+
+#[days x names] prices: random walks, a coint_share of them paired with an AR(1) spread partner
+def make_panel(names, days, coint_share=0.3, seed=0):
+    rng = np.random.RandomState(seed)
+    prices = 100 * np.exp(np.cumsum(rng.randn(days, names) * 0.015, axis=0))
+    partners = int(names * coint_share) // 2
+    for n in range(partners):
+        leader, follower = 2 * n, 2 * n + 1
+        phi = 0.5 ** (1.0 / rng.uniform(5, 30))
+        shocks = rng.standard_t(4, days)
+        spread = np.zeros(days)
+        for t in range(1, days):
+            spread[t] = phi * spread[t - 1] + shocks[t]
+        prices[:, follower] = rng.uniform(0.5, 1.5) * prices[:, leader] + 10 + spread
+    columns = ['S%03d' % n for n in range(names)]
+    return pd.DataFrame(prices, index=pd.bdate_range('2010-01-04', periods=days), columns=columns)
+
+
+def median_time(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started)
+    return float(np.median(seconds))
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+#(stage name, number of pairs the stage processes, callable) for one panel
+def get_stages(algo, prices):
+    window = prices.iloc[-algo.COINT_LOOKBACK:]
+    corr_matrix = algo.get_correlation_matrix(window)
+    all_pairs = np.argwhere(np.triu(np.ones(corr_matrix.shape, dtype=bool), 1))
+    values = window.values.T
+    Y = values[all_pairs[:, 0]]
+    X = values[all_pairs[:, 1]]
+    sample = all_pairs[:SPREAD_SAMPLE]
+    spreads = algo.get_batch_spreads(values[sample[:, 0]], values[sample[:, 1]])
+
+    def each_spread(test):
+        def run():
+            for row in spreads:
+                try:
+                    test(row)
+                except Exception:
+                    pass
+        return run
+
+    def screen():
+        algo.screen_sector(prices, algo.SpreadCache(), algo.ScreeningStats())
+
+    return [
+        ('corr_prefilter', len(all_pairs), lambda: algo.get_correlated_pairs(algo.get_correlation_matrix(window))),
+        ('coint', 2 * len(all_pairs), lambda: algo.get_batch_coint_pvalues(np.concatenate([Y, X]),
+                                                                           np.concatenate([X, Y]))),
+        ('spreads', len(all_pairs), lambda: algo.get_batch_spreads(Y, X)),
+        ('adf', len(spreads), each_spread(algo.get_adf_pvalue)),
+        ('adf_batch', len(spreads), lambda: algo.get_adf_pvalue(spreads)),
+        ('hurst', len(spreads), each_spread(algo.get_hurst_hvalue)),
+        ('hurst_batch', len(spreads), lambda: algo.get_hurst_hvalue(spreads)),
+        ('half_life', len(spreads), each_spread(algo.get_half_life)),
+        ('half_life_batch', len(spreads), lambda: algo.get_half_life(spreads)),
+        ('shapiro', len(spreads), each_spread(algo.get_shapiro_pvalue)),
+        ('screen_sector', len(all_pairs), screen),
+    ]
+
+
+def run_cases(cases, repeat, stages=None):
+    algo = quantopian_local.load_algorithm()
+    results = {}
+    for names, days in cases:
+        prices = make_panel(names, days)
+        for stage, pairs, function in get_stages(algo, prices):
+            if stages and stage not in stages:
+                continue
+            seconds = median_time(function, repeat)
+            results['%s/%dx%d' % (stage, names, days)] = {
+                'stage': stage, 'names': names, 'days': days, 'pairs': pairs, 'seconds': seconds,
+                'pairs_per_second': pairs / seconds if seconds > 0 else float('inf'),
+                'peak_bytes': peak_memory(function)}
+    return results
+
+
+def print_table(results, baseline=None):
+    print('%-30s %8s %12s %14s %12s %10s' % ('case', 'pairs', 'seconds', 'pairs/second', 'peak MB', 'vs base'))
+    for key in sorted(results, key=lambda k: (results[k]['names'], results[k]['days'], k)):
+        row = results[key]
+        ratio = ''
+        if baseline and key in baseline['results']:
+            ratio = '%.2fx' % (row['seconds'] / baseline['results'][key]['seconds'])
+        print('%-30s %8d %12.5f %14.1f %12.2f %10s' % (key, row['pairs'], row['seconds'], row['pairs_per_second'],
+                                                    row['peak_bytes'] / 1e6, ratio))
+
+
+#stages slower than tolerance times their baseline by more than floor seconds; millisecond stages
+#easily double from timer and scheduler noise, so a ratio alone is not a regression
+def find_regressions(results, baseline, tolerance, floor):
+    regressions = []
+    for key, row in results.items():
+        base = baseline['results'].get(key)
+        if base and row['seconds'] > tolerance * base['seconds'] and row['seconds'] - base['seconds'] > floor:
+            regressions.append((key, base['seconds'], row['seconds']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pair-screening funnel.')
+    parser.add_argument('--full', action='store_true', help='run the full size grid')
+    parser.add_argument('--case', action='append', default=[], metavar='NAMESxDAYS',
+                        help='extra case, e.g. 200x1000 (repeatable)')
+    parser.add_argument('--stage', action='append', default=[], help='only run these stages (repeatable)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='allowed slowdown factor before --check fails')
+    parser.add_argument('--floor', type=float, default=0.02,
+                        help='slowdowns under this many seconds never count as regressions')
+    args = parser.parse_args(argv)
+
+    cases = list(FULL_CASES if args.full else QUICK_CASES)
+    cases += [tuple(int(part) for part in case.lower().split('x')) for case in args.case]
+    warnings.simplefilter('ignore')
+    results = run_cases(cases, args.repeat, args.stage)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.save_baseline:
+        saved = baseline['results'] if baseline else {}
+        saved.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'results': saved}, f, indent=1, sort_keys=True)
+        print('baseline written to ' + args.baseline)
+
+    if args.check:
+        if baseline is None:
+            print('no baseline at ' + args.baseline)
+            return 1
+        regressions = find_regressions(results, baseline, args.tolerance, args.floor)
+        for key, before, after in regressions:
+            print('REGRESSION %s: %.5fs -> %.5fs' % (key, before, after))
+        #a stage without a baseline is not guarded, fail until it is saved
+        missing = sorted(key for key in results if key not in baseline['results'])
+        for key in missing:
+            print('NO BASELINE %s: run --save-baseline' % key)
+        return 1 if regressions or missing else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#Import-time report for pair_trading.py: cold start of the algorithm and of its optional test libraries
+#
+#Every case runs in a fresh interpreter (best of --repeat), timing from before its first import to the
+#end of the case, so shared dependencies such as numpy are counted in every row. statsmodels and scipy
+#are only imported when a test backend that needs them is first called; the rows after the plain
+#load show what that first call costs.
+#
+#   python import_report.py
+#   python import_report.py --repeat 5 --json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+LOAD = 'import quantopian_local; algo = quantopian_local.load_algorithm()'
+SPREAD = 'import numpy as np; spread = np.cumsum(np.random.RandomState(0).randn(730))'
+
+#(case, statements run after the timer starts)
+CASES = [
+    ('numpy + pandas', ['import numpy, pandas']),
+    ('scipy.stats', ['import scipy.stats']),
+    ('statsmodels.tsa.stattools', ['import statsmodels.tsa.stattools']),
+    ('load pair_trading', [LOAD]),
+    ('load + numpy coint/adf/half-life', [LOAD, SPREAD, 'algo.get_adf_pvalue(spread)', 'algo.get_half_life(spread)',
+                                          'algo.get_batch_coint_pvalues(spread[np.newaxis], spread[np.newaxis] + 1)']),
+    ('load + statsmodels adf', [LOAD, SPREAD, 'algo.get_sm_adf_pvalue(spread)']),
+    ('load + scipy shapiro', [LOAD, SPREAD, 'algo.get_shapiro_pvalue(spread)']),
+]
+
+
+def time_case(statements):
+    script = '; '.join(['import sys, time, warnings', 'sys.path.insert(0, %r)' % HERE, 'warnings.simplefilter("ignore")',
+                        'started = time.perf_counter()'] + statements + ['print(time.perf_counter() - started)'])
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=HERE)
+    return float(output.decode().split()[-1])
+
+
+def run_cases(repeat):
+    return [(case, min(time_case(statements) for _ in range(repeat))) for case, statements in CASES]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure cold import times of pair_trading.py.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+    results = run_cases(args.repeat)
+    if args.json:
+        print(json.dumps(dict(results), indent=1, sort_keys=True))
+        return 0
+    print('%-36s %10s' % ('case', 'seconds'))
+    for case, seconds in results:
+        print('%-36s %10.3f' % (case, seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
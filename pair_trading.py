@@ -11,9 +11,11 @@ import quantopian.pipeline.data.morningstar as ms
 
 import numpy as np
 import pandas as pd
-import statsmodels.tsa.stattools as sm
-from scipy.stats import shapiro
 import math
+import time
+import json
+import heapq
+from collections import OrderedDict
 
 COMMISSION         = 0.005
 LEVERAGE           = 1.0
@@ -77,10 +79,57 @@ Z_WINDOW               = 20 # used for zscore calculation, must be <= HEDGE_LOOK
 #Shapiro-Wilke test
 SHAPIROWILKE_LOOKBACK  = COINT_LOOKBACK
 SHAPIROWILKE_P_MIN     = P_CUTOFF
+#Price matrix fetched once per sector, long enough for every test
+SCREEN_LOOKBACK        = max(COINT_LOOKBACK, ADF_LOOKBACK, HURST_LOOKBACK, HALF_LIFE_LOOKBACK,
+                             SHAPIROWILKE_LOOKBACK)
+#Candidate pairs per batched Engle-Granger run (bounds the regression workspace)
+COINT_BATCH_SIZE       = 256
+#Test implementations: 'numpy' runs the batched NumPy coint, ADF and half-life, 'statsmodels' the
+#library calls they reproduce. Libraries are imported on the first call of a test that needs them
+TEST_BACKEND           = 'numpy'
+#Worker processes for sector screening, 0 or 1 screens serially in the algorithm process
+SCREEN_PROCESSES       = 0
+#Order the per-spread tests by measured cost / rejection rate instead of the fixed order above
+ADAPTIVE_TEST_ORDER    = True
+#Re-screening: pairs rejected far past a threshold are not re-tested on the next rebalances
+#Off by default: INTERVAL months of new bars is more than PAIR_STATS_MAX_SHIFT of COINT_LOOKBACK, so with
+#the defaults every cached pair would be re-tested anyway. Worth enabling for INTERVAL = 1 and long lookbacks
+PAIR_STATS_SIZE        = 0     # cached pairs (least recently used evicted), 0 re-tests everything
+PAIR_STATS_MAX_SHIFT   = 0.1   # share of the window replaced since the last full test before a re-test
+PAIR_STATS_MARGIN      = 2.0   # distance past a threshold that counts as far: decades for p-values,
+                               # threshold widths otherwise
+PAIR_STATS_HEDGE_MOVE  = 0.05  # relative hedge ratio change since the last test that forces a re-test
+#Screening price histories are cached and fetched ahead of each rebalance month, PREFETCH_DAYS_BEFORE
+#trading days before the end of the month before it; choose_pairs then only fetches the bars since
+PRICE_CACHE_SIZE       = 5000  # cached stocks (least recently used evicted), 0 fetches everything at the rebalance
+PREFETCH_DAYS_BEFORE   = 2
+PREFETCH_THREADS       = 0     # threads fetching history chunks, 0 or 1 fetches in one call
+PREFETCH_CHUNK         = 250   # stocks per history call in a prefetch thread
+
+#Candidate pairs: 'industry' screens within each REAL_UNIVERSE code, 'cluster' clusters the whole
+#QTradableStocksUS universe on PCA loadings of its returns and screens within each cluster
+CANDIDATE_MODE         = 'industry'
+CLUSTER_COMPONENTS     = 10    # principal components of the return embedding
+CLUSTER_SIZE           = 25    # target names per cluster
+CLUSTER_MAX_SIZE       = 50    # larger clusters are split again
+
+#Drop names in the pipeline that have no sector peer within PARTNER_CORR_SLACK of CORR_MIN as of the
+#previous close (the slack covers the day between the pipeline and the history window). Industry mode only
+PIPELINE_PREFILTER     = True
+PARTNER_CORR_SLACK     = 0.02
 
 #Rank pairs by (select key): 'coint', 'adf', 'corr', 'half-life', 'hurst'
 RANK_BY = 'half-life'
 
+#Pick the traded pairs among those that passed: 'greedy' takes the best-ranked pair with no leg already
+#used, 'matching' the DESIRED_PAIRS pairs sharing no leg with the best total rank score
+SELECTION_MODE         = 'greedy'
+MATCHING_MAX_NODES     = 1000000 # search nodes before matching keeps the best selection found so far
+
+#Trading signal: 'daily' checks every pair once a day before the close; 'minute' streams every bar
+#through handle_data, with HEDGE_LOOKBACK and Z_WINDOW counted in minute bars
+SIGNAL_MODE            = 'daily'
+
 #Display graphs
 RECORD_LEVERAGE = True
 
@@ -94,25 +143,36 @@ def initialize(context):
     context.num_universes = len(context.codes)
     context.universes = {}
 
+    #one pipeline for every sector, split by its sector column in choose_pairs
     if not RUN_SAMPLE_PAIRS:
-        for code in context.codes:
-            context.universes[code] = {}
-            context.universes[code]['pipe'] = Pipeline()
-            context.universes[code]['pipe'] = algo.attach_pipeline(context.universes[code]['pipe'],
-                                                          name = str(code))
-            context.universes[code]['pipe'].set_screen(QTradableStocksUS() &
-                                    context.industry_code.eq(code))
+        universe = QTradableStocksUS()
+        if CANDIDATE_MODE != 'cluster':
+            universe = universe & context.industry_code.element_of(context.codes)
+            for code in context.codes:
+                context.universes[code] = {}
+        screen = universe
+        #clusters only exist after the pipeline, ungrouped the factor would correlate the whole
+        #universe every day, so cluster mode screens without it
+        if RUN_CORRELATION_TEST and PIPELINE_PREFILTER and CANDIDATE_MODE != 'cluster':
+            partners = CorrelatedPartners(inputs=[USEquityPricing.close,
+                                                  ms.asset_classification.morningstar_industry_code],
+                                          window_length=COINT_LOOKBACK, mask=universe)
+            screen = universe & (partners > 0)
+        algo.attach_pipeline(Pipeline(columns={'sector': context.industry_code}, screen=screen), name='pairs')
 
     context.num_pairs = DESIRED_PAIRS
-    context.top_yield_pairs = []
     context.universe_set = False
 
-    context.coint_data = {}
-    context.coint_pairs = {}
-    context.real_yield_keys = []
-    context.pair_status = {}
-    context.total_stock_list = []
+    context.pairs = PairRegistry()
+    context.hedges = None
+    context.hedge_date = None
+    context.stream = None
     context.universe_pool = []
+    context.spread_cache = SpreadCache()
+    context.screening_records = []
+    context.filter_stats = ScreeningStats()
+    context.pair_stats = PairStatsCache(PAIR_STATS_SIZE)
+    context.price_cache = PriceCache(PRICE_CACHE_SIZE)
 
     context.target_weights = {}
 
@@ -130,14 +190,19 @@ def initialize(context):
                                                                                                    minutes=1))
     else:
         schedule_function(choose_pairs, date_rules.month_start(), time_rules.market_open(hours=0, minutes=1))
-    schedule_function(check_pair_status, date_rules.every_day(), time_rules.market_close(minutes=30))
+        if PRICE_CACHE_SIZE > 0:
+            schedule_function(prefetch_prices, date_rules.month_end(days_offset=PREFETCH_DAYS_BEFORE),
+                              time_rules.market_close(minutes=15))
+    if SIGNAL_MODE == 'daily':
+        schedule_function(check_pair_status, date_rules.every_day(), time_rules.market_close(minutes=30))
 
 def empty_data(context):
-    context.coint_data = {}
-    context.coint_pairs = {}
-    context.real_yield_keys = []
-    context.top_yield_pairs = []
-    context.total_stock_list = []
+    context.pairs = PairRegistry()
+    context.spread_cache = SpreadCache()
+    context.pair_stats.hits = 0
+    context.pair_stats.misses = 0
+    context.price_cache.hits = 0
+    context.price_cache.misses = 0
 
 def empty_target_weights(context):
     for s in context.target_weights.keys():
@@ -145,14 +210,118 @@ def empty_target_weights(context):
     for equity in context.portfolio.positions:  
         order_target_percent(equity, 0)
 
-def get_stock_partner(context, stock):
-    partner = 0
-    for pair in context.coint_pairs.keys():
-        if stock == pair[0]:
-            partner = pair[1]
-        elif stock == pair[1]:
-            partner = pair[0]
-    return partner     
+#one pair that passed screening: its legs, sector and test results ('N/A' for tests not run)
+class PairRecord(object):
+    __slots__ = ['y', 'x', 'code', 'corr', 'coint', 'adf', 'hurst', 'half_life', 'sw']
+    FIELDS = {'corr': 'corr', 'coint': 'coint', 'adf': 'adf', 'hurst': 'hurst', 'half-life': 'half_life',
+              'sw': 'sw'}
+
+    def __init__(self, y, x, code, results):
+        self.y = y
+        self.x = x
+        self.code = code
+        for stage, field in self.FIELDS.items():
+            setattr(self, field, results.get(stage, 'N/A'))
+
+    def get(self, stage):
+        return getattr(self, self.FIELDS[stage])
+
+#pairs selected at a rebalance in rank order, no two sharing an asset: an asset -> record index for
+#partner lookups, the set of paired assets for de-duplication, and the long/short state of the
+#traded pairs as arrays aligned with pairs
+class PairRegistry(object):
+    def __init__(self):
+        self.records = []
+        self.by_asset = {}
+        self.used = set()
+        self.pairs = []
+        self.currently_long = np.zeros(0, dtype=bool)
+        self.currently_short = np.zeros(0, dtype=bool)
+
+    #accept a pair unless one of its legs is already paired
+    def add(self, record):
+        if record.y in self.used or record.x in self.used:
+            return False
+        self.records.append(record)
+        self.used.update((record.y, record.x))
+        self.by_asset[record.y] = record
+        self.by_asset[record.x] = record
+        return True
+
+    #trade the first num_pairs accepted pairs, all starting flat
+    def select(self, num_pairs):
+        self.pairs = [(record.y, record.x) for record in self.records[:num_pairs]]
+        self.currently_long = np.zeros(len(self.pairs), dtype=bool)
+        self.currently_short = np.zeros(len(self.pairs), dtype=bool)
+
+    #other leg of an accepted pair, 0 for an unpaired stock
+    def get_partner(self, stock):
+        record = self.by_asset.get(stock)
+        if record is None:
+            return 0
+        return record.x if stock == record.y else record.y
+
+#rank score of a pair on a test, higher is better: correlation as is, lower values better otherwise
+def get_rank_score(record, stage):
+    value = record.get(stage)
+    return value if stage == 'corr' else -value
+
+#pop pairs best first off a heap, accepting those with no used leg until num_pairs are accepted;
+#equal scores keep the screening order
+def select_greedy(records, stage, num_pairs):
+    heap = [(-get_rank_score(record, stage), n) for n, record in enumerate(records)]
+    heapq.heapify(heap)
+    registry = PairRegistry()
+    while heap and len(registry.records) < num_pairs:
+        registry.add(records[heapq.heappop(heap)[1]])
+    return registry
+
+#the most disjoint pairs up to num_pairs, with the highest total score among those: depth-first
+#branch and bound over the pairs best first, so the first selection reached is the greedy one.
+#A branch is cut once the best scores left, overlaps ignored, cannot beat the incumbent
+def select_matching(records, stage, num_pairs):
+    order = sorted(range(len(records)), key=lambda n: -get_rank_score(records[n], stage))
+    scores = [get_rank_score(records[n], stage) for n in order]
+    prefix = np.concatenate([[0.0], np.cumsum(scores)])
+    used = set()
+    chosen = []
+    best = {'key': (-1, 0.0), 'chosen': [], 'nodes': 0}
+
+    def search(start, total):
+        if (len(chosen), total) > best['key']:
+            best['key'] = (len(chosen), total)
+            best['chosen'] = list(chosen)
+        need = num_pairs - len(chosen)
+        if need == 0:
+            return
+        for i in range(start, len(order)):
+            best['nodes'] += 1
+            if best['nodes'] > MATCHING_MAX_NODES:
+                return
+            count = min(need, len(order) - i)
+            if (len(chosen) + count, total + prefix[i + count] - prefix[i]) <= best['key']:
+                return
+            record = records[order[i]]
+            if record.y in used or record.x in used:
+                continue
+            used.update((record.y, record.x))
+            chosen.append(order[i])
+            search(i + 1, total + scores[i])
+            chosen.pop()
+            used.difference_update((record.y, record.x))
+
+    search(0, 0.0)
+    if best['nodes'] > MATCHING_MAX_NODES:
+        log.warn("Pair matching stopped after " + str(MATCHING_MAX_NODES) + " nodes, keeping the best selection found")
+    registry = PairRegistry()
+    for n in best['chosen']:
+        registry.add(records[n])
+    return registry
+
+def select_pairs(records, stage, num_pairs):
+    if SELECTION_MODE == 'matching':
+        return select_matching(records, stage, num_pairs)
+    return select_greedy(records, stage, num_pairs)
 
 #calculate total commission cost of a stock given betsize
 def get_commission(data, stock, bet_size):
@@ -163,13 +332,216 @@ def get_commission(data, stock, bet_size):
 def get_price_history(data, stock, length):
     return data.history(stock, "price", length, '1d')
 
+#fetch one [dates x assets] price matrix covering the longest screening lookback
+def get_price_matrix(data, stocks, length):
+    return data.history(list(stocks), "price", length, '1d')
+
+#price matrix of many stocks, fetched in chunks across a thread pool when threads > 1
+def fetch_price_matrix(data, stocks, length, threads=0):
+    stocks = list(stocks)
+    if threads <= 1 or len(stocks) <= PREFETCH_CHUNK:
+        return get_price_matrix(data, stocks, length)
+    from concurrent.futures import ThreadPoolExecutor
+    chunks = [stocks[n:n + PREFETCH_CHUNK] for n in range(0, len(stocks), PREFETCH_CHUNK)]
+    with ThreadPoolExecutor(threads) as pool:
+        frames = list(pool.map(lambda chunk: get_price_matrix(data, chunk, length), chunks))
+    return pd.concat(frames, axis=1)
+
+#daily price histories of recently fetched stocks, least recently used evicted past size. An entry
+#is brought up to date by fetching only the bars since it was stored: its last bar is replaced (it
+#may have been taken intraday) and the bar before must match the fresh history, otherwise the prices
+#were adjusted and the entry is fetched again in full
+class PriceCache(object):
+    def __init__(self, size):
+        self.size = size
+        #stock -> (dates, prices); stocks fetched together share their dates index
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, stocks=None):
+        if stocks is None:
+            self.entries.clear()
+        for stock in stocks or []:
+            self.entries.pop(stock, None)
+
+    #[dates x stocks] last length daily prices up to now, as get_price_matrix returns them
+    def get(self, data, stocks, length, threads=0):
+        stocks = list(stocks)
+        today = get_datetime().date()
+        fresh = {}
+        missing = []
+        groups = {}
+        for stock in stocks:
+            entry = self.entries.get(stock)
+            if entry is None or len(entry[0]) != length or length < 2:
+                missing.append(stock)
+            else:
+                dates = entry[0]
+                groups.setdefault((dates[0], dates[-2], dates[-1]), (dates, []))[1].append(stock)
+        for dates, group in groups.values():
+            count = int(np.busday_count(dates[-1].date(), today)) + 2
+            recent = fetch_price_matrix(data, group, count, threads) if count <= length else None
+            if recent is None or dates[-2] not in recent.index:
+                missing.extend(group)
+                continue
+            k = recent.index.get_loc(dates[-2])
+            old = np.column_stack([self.entries[stock][1] for stock in group])
+            new = recent.values
+            same = (old[-2] == new[k]) | (np.isnan(old[-2]) & np.isnan(new[k]))
+            dates = dates[:-1].append(recent.index[k + 1:])[-length:]
+            values = np.concatenate([old[:-1], new[k + 1:]])[-length:].T.copy()
+            for n, stock in enumerate(group):
+                if same[n]:
+                    fresh[stock] = (dates, values[n])
+                else:
+                    missing.append(stock)
+        self.hits += len(fresh)
+        self.misses += len(missing)
+        if missing:
+            prices = fetch_price_matrix(data, missing, length, threads)
+            values = prices.values.T.copy()
+            for n, stock in enumerate(missing):
+                fresh[stock] = (prices.index, values[n])
+        for stock in stocks:
+            self.entries[stock] = fresh[stock]
+            self.entries.move_to_end(stock)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        dates = fresh[stocks[0]][0] if stocks else pd.DatetimeIndex([])
+        return pd.DataFrame(np.column_stack([fresh[stock][1] for stock in stocks]) if stocks else None,
+                            index=dates, columns=stocks)
+
 #return correlation and cointegration pvalue
 def get_corr_coint(data, s1_price, s2_price):
-    score_pos, pvalue_pos, _ = sm.coint(s1_price, s2_price)
-    score_neg, pvalue_neg, _ = sm.coint(s2_price, s1_price)
+    coint_test = get_test_backend('coint')[0]
+    pvalue_pos, pvalue_neg = coint_test(np.array([s1_price, s2_price]), np.array([s2_price, s1_price]))
     correlation = s1_price.corr(s2_price)
     return correlation, pvalue_pos, pvalue_neg
 
+#MacKinnon (1994) p-value surface for constant-only regressions, keyed by number of I(1) series:
+#(max tau, min tau, tau star, small-p polynomial, large-p polynomial)
+MACKINNON_C = {1: (2.74, -18.83, -1.61, [2.1659, 1.4412, 0.038269],
+                   [1.7339, 0.93202, -0.12745, -0.010368]),
+               2: (0.92, -18.86, -2.62, [2.92, 1.5012, 0.039796],
+                   [2.1945, 0.64695, -0.29198, -0.042377])}
+SQRTEPS = np.sqrt(np.finfo(float).eps)
+
+normal_cdf = np.vectorize(lambda z: 0.5 * math.erfc(-z / math.sqrt(2.0)), otypes=[float])
+
+#MacKinnon approximate p-values of ADF / Engle-Granger t-statistics
+def get_mackinnon_pvalues(stats, N):
+    tau_max, tau_min, tau_star, small_p, large_p = MACKINNON_C[N]
+    stats = np.asarray(stats, dtype=float)
+    with np.errstate(invalid='ignore', over='ignore'):
+        z = np.where(stats <= tau_star, np.polyval(small_p[::-1], stats), np.polyval(large_p[::-1], stats))
+        pvalues = normal_cdf(z)
+        pvalues[stats > tau_max] = 1.0
+        pvalues[stats < tau_min] = 0.0
+    return pvalues
+
+#solve a stack of small systems, rows with a singular matrix get nan
+def batch_solve(A, b):
+    try:
+        return np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        out = np.full(b.shape, np.nan)
+        for n in range(len(A)):
+            try:
+                out[n] = np.linalg.solve(A[n], b[n])
+            except np.linalg.LinAlgError:
+                pass
+        return out
+
+#ADF regressors [const, level, lagged diffs...] for every row, [rows x obs x columns]
+def get_adf_design(X, diffs, lags, add_const):
+    length = diffs.shape[1]
+    columns = [X[:, lags:length]]
+    for lag in range(1, lags + 1):
+        columns.append(diffs[:, lags - lag:length - lag])
+    if add_const:
+        columns.insert(0, np.ones(columns[0].shape))
+    return np.stack(columns, axis=2)
+
+#ADF t-statistics of every row of X with the lag picked by AIC, as sm.adfuller(autolag='AIC')
+def get_batch_adf_stats(X, maxlag=None, add_const=True):
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    nobs = X.shape[1]
+    ntrend = 1 if add_const else 0
+    if maxlag is None:
+        maxlag = min(nobs // 2 - ntrend - 1, int(np.ceil(12.0 * np.power(nobs / 100.0, 1 / 4.0))))
+    diffs = np.diff(X, axis=1)
+
+    #pick the lag on a common sample, comparing AIC from the normal equations
+    design = get_adf_design(X, diffs, maxlag, add_const)
+    target = diffs[:, maxlag:]
+    XtX = np.einsum('bnk,bnl->bkl', design, design)
+    Xty = np.einsum('bnk,bn->bk', design, target)
+    yty = (target * target).sum(axis=1)
+    length = target.shape[1]
+    aic = np.empty((len(X), maxlag + 1))
+    for lag in range(maxlag + 1):
+        k = ntrend + 1 + lag
+        coef = batch_solve(XtX[:, :k, :k], Xty[:, :k])
+        ssr = yty - (coef * Xty[:, :k]).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aic[:, lag] = length * np.log(ssr / length) + 2 * k
+    aic[np.isnan(aic)] = np.inf
+    best_lags = aic.argmin(axis=1)
+
+    #refit each row on its own sample at its chosen lag
+    stats = np.empty(len(X))
+    for lag in np.unique(best_lags):
+        rows = best_lags == lag
+        design = get_adf_design(X[rows], diffs[rows], lag, add_const)
+        target = diffs[rows, lag:]
+        XtX = np.einsum('bnk,bnl->bkl', design, design)
+        coef = batch_solve(XtX, np.einsum('bnk,bn->bk', design, target))
+        resid = target - np.einsum('bnk,bk->bn', design, coef)
+        scale = (resid * resid).sum(axis=1) / (target.shape[1] - design.shape[2])
+        unit = np.zeros((rows.sum(), design.shape[2]))
+        unit[:, ntrend] = 1.0
+        with np.errstate(invalid='ignore'):
+            stats[rows] = coef[:, ntrend] / np.sqrt(scale * batch_solve(XtX, unit)[:, ntrend])
+    return stats
+
+#Engle-Granger cointegration pvalues of every row of Y on the matching row of X, as sm.coint
+def get_batch_coint_pvalues(Y, X):
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    pvalues = np.empty(len(Y))
+    for start in range(0, len(Y), COINT_BATCH_SIZE):
+        Y_dev = Y[start:start + COINT_BATCH_SIZE]
+        X_dev = X[start:start + COINT_BATCH_SIZE]
+        Y_dev = Y_dev - Y_dev.mean(axis=1)[:, np.newaxis]
+        X_dev = X_dev - X_dev.mean(axis=1)[:, np.newaxis]
+        resid = Y_dev - batch_hedge_ratio(Y_dev, X_dev)[:, np.newaxis] * X_dev
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsquared = 1.0 - (resid * resid).sum(axis=1) / (Y_dev * Y_dev).sum(axis=1)
+        stats = get_batch_adf_stats(resid, add_const=False)
+        #(almost) perfectly collinear legs are cointegrated by construction
+        stats[rsquared >= 1 - 100 * SQRTEPS] = -np.inf
+        pvalues[start:start + COINT_BATCH_SIZE] = get_mackinnon_pvalues(stats, 2)
+    return pvalues
+
+#pairwise price correlations of a [dates x assets] matrix in one matrix product
+def get_correlation_matrix(prices):
+    #fixed memory layout keeps the BLAS summation order, and so the result, identical across callers
+    dev = np.ascontiguousarray(prices, dtype=float)
+    dev = dev - dev.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dev = dev / np.sqrt((dev * dev).sum(axis=0))
+    return dev.T.dot(dev)
+
+#(i, j) column indices, i < j, of the pairs passing the correlation test
+def get_correlated_pairs(corr_matrix):
+    if RUN_CORRELATION_TEST:
+        with np.errstate(invalid='ignore'):
+            passed = np.abs(corr_matrix) > CORR_MIN
+    else:
+        passed = np.ones(corr_matrix.shape, dtype=bool)
+    return np.argwhere(np.triu(passed, 1))
+
 #return long and short moving avg
 def get_mvg_averages(data, s1, s2, long_length, short_length):
     prices = data.history([s1, s2], "price", long_length, '1d')
@@ -178,13 +550,142 @@ def get_mvg_averages(data, s1, s2, long_length, short_length):
     short_ma = np.mean(short_prices[s1] - short_prices[s2])
     return long_ma, short_ma
 
-def hedge_ratio(Y, X, add_const=True):
-    if add_const:
-        X = sm.add_constant(X)
-        model = sm.OLS(Y, X).fit()
-        return model.params[1]
-    model = sm.OLS(Y, X).fit()
-    return model.params.values 
+#last window daily spreads of every selected pair in a [pairs x window] ring, with running sums
+#so the z-score of the newest spread is O(1) per pair
+class SpreadWindow(object):
+    def __init__(self, num_pairs, window):
+        self.window = window
+        self.spreads = np.zeros((num_pairs, window))
+        self.sum = np.zeros(num_pairs)
+        self.sum_sq = np.zeros(num_pairs)
+        self.head = 0
+        self.count = 0
+
+    #recompute the sums from the ring, bounds float drift and clears nans that left the window
+    def resync(self):
+        self.sum = self.spreads.sum(axis=1)
+        self.sum_sq = (self.spreads * self.spreads).sum(axis=1)
+
+    def push(self, new_spreads):
+        old_spreads = self.spreads[:, self.head]
+        self.sum += new_spreads - old_spreads
+        self.sum_sq += new_spreads * new_spreads - old_spreads * old_spreads
+        self.spreads[:, self.head] = new_spreads
+        self.head = (self.head + 1) % self.window
+        self.count += 1
+        if self.head == 0 or not np.isfinite(self.sum).all():
+            self.resync()
+
+    #z-score of the newest spread against the window (population std, as np.std)
+    def zscores(self):
+        n = min(self.count, self.window)
+        if n == 0:
+            return np.full(len(self.sum), np.nan)
+        mean = self.sum / n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.sqrt(np.maximum(self.sum_sq / n - mean * mean, 0.0))
+            return (self.spreads[:, (self.head - 1) % self.window] - mean) / std
+
+#windowed OLS hedge ratios (with intercept) of many pairs kept as running sums over a [pairs x window]
+#ring of bars, so a bar costs the same whatever the window. Daily checks and minute streams share it
+class RollingHedges(object):
+    def __init__(self, y_prices, x_prices):
+        self.y = np.array(y_prices, dtype=float)
+        self.x = np.array(x_prices, dtype=float)
+        self.window = self.y.shape[1]
+        self.head = 0
+        self.resync()
+
+    #recompute the sums from the ring, bounds float drift and clears nans that left the window
+    def resync(self):
+        self.sum_y = self.y.sum(axis=1)
+        self.sum_x = self.x.sum(axis=1)
+        self.sum_xx = (self.x * self.x).sum(axis=1)
+        self.sum_xy = (self.x * self.y).sum(axis=1)
+
+    def replace(self, slot, y, x):
+        old_y = self.y[:, slot]
+        old_x = self.x[:, slot]
+        self.sum_y += y - old_y
+        self.sum_x += x - old_x
+        self.sum_xx += x * x - old_x * old_x
+        self.sum_xy += x * y - old_x * old_y
+        self.y[:, slot] = y
+        self.x[:, slot] = x
+        if not np.isfinite(self.sum_xy).all():
+            self.resync()
+
+    #replace the oldest bar of every pair by the newest
+    def push(self, y, x):
+        self.replace(self.head, y, x)
+        self.head = (self.head + 1) % self.window
+        if self.head == 0:
+            self.resync()
+
+    #overwrite the newest bar of every pair, a bar that was still forming when it was pushed
+    def settle(self, y, x):
+        self.replace((self.head - 1) % self.window, y, x)
+
+    def beta(self):
+        n = self.window
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return ((n * self.sum_xy - self.sum_x * self.sum_y) /
+                    (n * self.sum_xx - self.sum_x * self.sum_x))
+
+#per-bar signal state of the selected pairs for SIGNAL_MODE = 'minute': rolling hedges, the spread
+#window and the last price of every leg. Seeded once from a bar history, after that every bar
+#is a fixed number of [pairs] array operations and no history is fetched
+class PairStream(object):
+    def __init__(self, pairs, history):
+        self.stocks = list(history.columns)
+        columns = dict((stock, n) for n, stock in enumerate(self.stocks))
+        self.y_columns = np.array([columns[pair[0]] for pair in pairs], dtype=int)
+        self.x_columns = np.array([columns[pair[1]] for pair in pairs], dtype=int)
+        bars = history.ffill().values
+        self.hedges = RollingHedges(bars[:HEDGE_LOOKBACK, self.y_columns].T, bars[:HEDGE_LOOKBACK, self.x_columns].T)
+        self.spread = SpreadWindow(len(pairs), Z_WINDOW)
+        self.last = bars[HEDGE_LOOKBACK - 1]
+        for bar in bars[HEDGE_LOOKBACK:]:
+            self.step(bar)
+
+    #apply one bar of prices (in stocks order, nan keeps the last price); returns the z-scores against
+    #the window before this bar's spreads enter it (nan until the window is full), hedges and leg prices
+    def step(self, prices):
+        prices = np.where(np.isfinite(prices), prices, self.last)
+        self.last = prices
+        y_prices = prices[self.y_columns]
+        x_prices = prices[self.x_columns]
+        self.hedges.push(y_prices, x_prices)
+        hedges = self.hedges.beta()
+        ready = self.spread.count > Z_WINDOW
+        zscores = self.spread.zscores()
+        self.spread.push(y_prices - hedges * x_prices)
+        if not ready:
+            zscores = np.full(len(zscores), np.nan)
+        return zscores, hedges, y_prices, x_prices
+
+#roll the selected pairs' hedges forward with one short history call: the previous bar is settled to
+#its close and the newest enters the window. Rebuilt from HEDGE_LOOKBACK bars when the bars do not
+#continue the window. Returns the latest prices
+def update_hedges(context, data):
+    pairs = context.pairs.pairs
+    y_stocks = [pair[0] for pair in pairs]
+    x_stocks = [pair[1] for pair in pairs]
+    stocks = list(set(y_stocks + x_stocks))
+    prices = data.history(stocks, 'price', 2, '1d')
+    dates = prices.index
+    y_prices = prices[y_stocks].values
+    x_prices = prices[x_stocks].values
+    if context.hedges is not None and dates[-1] == context.hedge_date:
+        context.hedges.settle(y_prices[-1], x_prices[-1])
+    elif context.hedges is not None and len(dates) > 1 and dates[-2] == context.hedge_date:
+        context.hedges.settle(y_prices[-2], x_prices[-2])
+        context.hedges.push(y_prices[-1], x_prices[-1])
+    else:
+        history = data.history(stocks, 'price', HEDGE_LOOKBACK, '1d')
+        context.hedges = RollingHedges(history[y_stocks].values.T, history[x_stocks].values.T)
+    context.hedge_date = dates[-1]
+    return prices.iloc[-1]
 
 def get_current_portfolio_weights(context, data):  
     positions = context.portfolio.positions  
@@ -207,38 +708,329 @@ def computeHoldingsPct(yShares, xShares, yPrice, xPrice):
     x_target_pct = xDol / notionalDol
     return (y_target_pct, x_target_pct)  
 
+#OLS slope (with intercept) of every row of Y on the matching row of X, [pairs x days] -> [pairs]
+def batch_hedge_ratio(Y, X):
+    Y_dev = Y - Y.mean(axis=1)[:, np.newaxis]
+    X_dev = X - X.mean(axis=1)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (X_dev * Y_dev).sum(axis=1) / (X_dev * X_dev).sum(axis=1)
+
+#residual spreads Y - hedge*X for a stack of candidate pairs, [pairs x days] -> [pairs x days]
+def get_batch_spreads(Y, X):
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    hedge = batch_hedge_ratio(Y, X)
+    return Y - hedge[:, np.newaxis] * X
+
 def get_spreads(data, s1_price, s2_price, length):
-    try:
-        hedge = hedge_ratio(s1_price, s2_price, add_const=True)      
-    except ValueError as e:
-        log.debug(e)
-        return
-    spreads = []
-    for i in range(length):
-        spreads = np.append(spreads, s1_price[i] - hedge*s2_price[i])
-    return spreads
+    s1_price = np.asarray(s1_price, dtype=float)[:length]
+    s2_price = np.asarray(s2_price, dtype=float)[:length]
+    return get_batch_spreads(s1_price, s2_price)[0]
+
+#PCA embedding of a [dates x assets] price matrix: every asset's loadings on the leading components
+#of its standardized log returns, scaled to unit length so nearby assets are highly correlated ones
+def get_return_embedding(prices, components):
+    returns = np.diff(np.log(np.asarray(prices, dtype=float)), axis=0)
+    returns = returns - returns.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.nan_to_num(returns / returns.std(axis=0))
+    u, s, vt = np.linalg.svd(returns, full_matrices=False)
+    loadings = (vt[:components] * s[:components, np.newaxis]).T
+    norms = np.sqrt((loadings * loadings).sum(axis=1))
+    norms[norms == 0] = 1.0
+    return loadings / norms[:, np.newaxis]
+
+#k-means labels of the rows of points, k-means++ seeding with a fixed seed so rebalances are repeatable
+def get_kmeans_labels(points, k, iterations=100):
+    rng = np.random.RandomState(0)
+    centers = [points[rng.randint(len(points))]]
+    distances = ((points - centers[0]) ** 2).sum(axis=1)
+    while len(centers) < k and distances.sum() > 0:
+        centers.append(points[rng.choice(len(points), p=distances / distances.sum())])
+        distances = np.minimum(distances, ((points - centers[-1]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+    labels = np.zeros(len(points), dtype=int)
+    for _ in range(iterations):
+        distances = (centers * centers).sum(axis=1) - 2 * points.dot(centers.T)
+        new_labels = distances.argmin(axis=1)
+        if _ > 0 and (new_labels == labels).all():
+            break
+        labels = new_labels
+        for n in range(len(centers)):
+            if (labels == n).any():
+                centers[n] = points[labels == n].mean(axis=0)
+    return labels
+
+#column indices of a [dates x assets] price matrix grouped into clusters of at most CLUSTER_MAX_SIZE,
+#so screening within clusters tests a number of pairs linear in the universe size
+def get_clusters(prices):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = np.flatnonzero(np.isfinite(np.log(np.asarray(prices, dtype=float))).all(axis=0))
+    if len(valid) == 0:
+        return []
+    points = get_return_embedding(np.asarray(prices, dtype=float)[:, valid], CLUSTER_COMPONENTS)
+    clusters = []
+    pending = [np.arange(len(valid))]
+    while pending:
+        members = pending.pop()
+        if len(members) <= CLUSTER_MAX_SIZE:
+            clusters.append(valid[members])
+            continue
+        parts = int(np.ceil(len(members) / float(CLUSTER_SIZE)))
+        labels = get_kmeans_labels(points[members], parts)
+        split = [members[labels == label] for label in np.unique(labels)]
+        #identical embeddings cannot be separated, cut them in index order instead
+        pending.extend(split if len(split) > 1 else np.array_split(members, parts))
+    return sorted(clusters, key=lambda members: members[0])
+
+#pipeline-side correlation prefilter: for every asset of the mask, the number of other assets of its
+#industry code whose price correlation over the window is within PARTNER_CORR_SLACK of CORR_MIN.
+#Without one an asset cannot be part of a candidate pair
+class CorrelatedPartners(CustomFactor):
+    def compute(self, today, assets, out, closes, codes):
+        #forward filled like the history window the screening sees
+        closes = pd.DataFrame(closes).ffill().values
+        groups = codes[-1]
+        for group in np.unique(groups):
+            members = np.flatnonzero(groups == group)
+            corr = np.abs(get_correlation_matrix(closes[:, members]))
+            np.fill_diagonal(corr, 0)
+            with np.errstate(invalid='ignore'):
+                out[members] = (corr > CORR_MIN - PARTNER_CORR_SLACK).sum(axis=1)
+
+#per-rebalance spread store keyed by (y, x, lookback), shared by every screening test
+class SpreadCache(object):
+    def __init__(self):
+        self.spreads = {}
+        self.hits = 0
+        self.misses = 0
+
+    #spreads of every (s1, s2) over the last length days; the missing ones are built with one
+    #batched regression over the stacked legs
+    def get(self, prices, pairs, length):
+        missing = [(s1, s2) for s1, s2 in pairs if (s1, s2, length) not in self.spreads]
+        self.hits += len(pairs) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            window = prices.values[-length:]
+            y_columns = prices.columns.get_indexer([s1 for s1, s2 in missing])
+            x_columns = prices.columns.get_indexer([s2 for s1, s2 in missing])
+            spreads = get_batch_spreads(window[:, y_columns].T, window[:, x_columns].T)
+            for (s1, s2), spread in zip(missing, spreads):
+                self.spreads[(s1, s2, length)] = spread
+        return [self.spreads[(s1, s2, length)] for s1, s2 in pairs]
+
+#sums [n, x, y, xx, xy, yy] of a hedge regression window, enough to move the window incrementally
+def get_regression_sums(y, x):
+    return np.array([len(y), x.sum(), y.sum(), x.dot(x), x.dot(y), y.dot(y)])
+
+def get_sums_hedge_ratio(sums):
+    n, sx, sy, sxx, sxy, syy = sums
+    return (sxy - sx * sy / n) / (sxx - sx * sx / n)
+
+#rejections that persist across rebalances, keyed by (y, x, lookback): the record of the last full
+#test, the end date of its window and its hedge regression sums. A pair rejected far past a threshold
+#reuses its record until the window has moved too far, its hedge ratio moves or its history is adjusted
+class PairStatsCache(object):
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        #asset -> price window it was last screened on, and the one before for the current sector
+        self.prices = {}
+        self.previous = {}
+        self.hits = 0
+        self.misses = 0
+
+    #drop the windows and entries of assets that left the screen, they could not be reused anyway
+    def retain(self, assets):
+        assets = set(assets)
+        self.prices = dict((asset, prices) for asset, prices in self.prices.items() if asset in assets)
+        self.previous = {}
+        for key in [key for key in self.entries if key[0] not in assets or key[1] not in assets]:
+            del self.entries[key]
+
+    #swap in a sector's new price windows; assets whose overlapping history changed (split or
+    #dividend adjustment) keep no previous window, so their pairs are re-tested. Windows are copied,
+    #a view would keep the whole sector price matrix alive until the next rebalance
+    def load(self, prices):
+        self.previous = {}
+        for asset in prices.columns:
+            new = prices[asset].iloc[-COINT_LOOKBACK:].copy()
+            old = self.prices.get(asset)
+            if old is not None:
+                overlap = old.index.intersection(new.index)
+                if len(overlap) and np.allclose(old[overlap].values, new[overlap].values, rtol=1e-12, atol=0):
+                    self.previous[asset] = old
+            self.prices[asset] = new
+
+    #the cached record of (s1, s2) if it can stand in for a full test this rebalance, else None
+    def reuse(self, s1, s2):
+        key = (s1, s2, COINT_LOOKBACK)
+        entry = self.entries.get(key)
+        old_y = self.previous.get(s1)
+        old_x = self.previous.get(s2)
+        if (entry is None or old_y is None or old_x is None
+            or old_y.index[-1] != entry['end'] or old_x.index[-1] != entry['end']):
+            self.misses += 1
+            return None
+        #slide the window: drop the bars before the new start, add the bars after the old end
+        new_y = self.prices[s1]
+        new_x = self.prices[s2]
+        dropped = old_y.index < new_y.index[0]
+        added = new_y.index > entry['end']
+        shift = entry['shift'] + added.sum()
+        if shift > PAIR_STATS_MAX_SHIFT * COINT_LOOKBACK:
+            self.misses += 1
+            return None
+        sums = (entry['sums'] - get_regression_sums(old_y.values[dropped], old_x.values[dropped])
+                + get_regression_sums(new_y.values[added], new_x.values[added]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            old_hedge = get_sums_hedge_ratio(entry['sums'])
+            new_hedge = get_sums_hedge_ratio(sums)
+        if not abs(new_hedge - old_hedge) <= PAIR_STATS_HEDGE_MOVE * abs(old_hedge):
+            self.misses += 1
+            return None
+        entry.update({'sums': sums, 'end': new_y.index[-1], 'shift': shift})
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry['record'])
+
+    #keep a freshly tested pair if it was rejected far past the threshold that stopped it, bounds is
+    #the (low, high) open interval of every stage in the order they ran
+    def store(self, s1, s2, record, bounds):
+        key = (s1, s2, COINT_LOOKBACK)
+        self.entries.pop(key, None)
+        for stage, (low, high) in bounds:
+            if not in_range(record[stage], low, high):
+                if not is_far(stage, record[stage], low, high):
+                    return
+                y = self.prices[s1]
+                x = self.prices[s2]
+                self.entries[key] = {'sums': get_regression_sums(y.values, x.values), 'end': y.index[-1],
+                                     'shift': 0, 'record': dict(record)}
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+                return
+
+#a failed test value more than PAIR_STATS_MARGIN outside (low, high): decades above the cutoff for
+#p-values, which swing by orders of magnitude as the window moves, threshold widths for the rest
+def is_far(stage, value, low, high):
+    if value == 'N/A' or not np.isfinite(value):
+        return False
+    if stage in ('coint', 'adf', 'sw'):
+        return value >= high * 10 ** PAIR_STATS_MARGIN
+    width = high - low
+    return value >= high + PAIR_STATS_MARGIN * width or value <= low - PAIR_STATS_MARGIN * width
+
+#ADF statistics and pvalues of one spread or every row of a [pairs x days] matrix,
+#as sm.adfuller(spreads, 1) (constant, lag 0 or 1 picked by AIC)
+def get_adf_stats(spreads):
+    spreads = np.asarray(spreads, dtype=float)
+    stats = get_batch_adf_stats(spreads, maxlag=1)
+    pvalues = get_mackinnon_pvalues(stats, 1)
+    if spreads.ndim > 1:
+        return stats, pvalues
+    return stats[0], pvalues[0]
+
 def get_adf_pvalue(spreads):
-    return sm.adfuller(spreads,1)[1]
+    return get_adf_stats(spreads)[1]
 
+#OU half-life of one spread or every row of a [pairs x days] matrix: -log(2) over the slope of
+#the one-day change on the previous level (first row zeroed as before), closed-form OLS with constant
 def get_half_life(spreads): 
+    spreads = np.asarray(spreads, dtype=float)
+    lag = np.roll(np.atleast_2d(spreads), 1, axis=1)
+    lag[:, 0] = 0
+    ret = np.atleast_2d(spreads) - lag
+    ret[:, 0] = 0
+    lag = lag - lag.mean(axis=1)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_life = -np.log(2) * (lag * lag).sum(axis=1) / (lag * ret).sum(axis=1)
+    return half_life if spreads.ndim > 1 else half_life[0]
+
+#Hurst exponent of one spread, or of every row of a [pairs x days] matrix: twice the slope of
+#log10 sqrt(std(x[t+lag] - x[t])) on log10 lag. The variances of all lagged differences come from
+#prefix sums and one FFT autocorrelation per row instead of a std per lag
+def get_hurst_hvalue(spreads):
+    spreads = np.asarray(spreads, dtype=float)
+    X = np.atleast_2d(spreads)
+    X = X - X.mean(axis=1)[:, None]
+    T = X.shape[1]
+    lags = np.arange(2, 100)
+    nfft = 1 << int(2 * T - 1).bit_length()
+    spectrum = np.fft.rfft(X, nfft)
+    #cross[:, lag] = sum_t x[t] x[t+lag]
+    cross = np.fft.irfft(spectrum * np.conj(spectrum), nfft)[:, lags]
+    S = np.concatenate([np.zeros((len(X), 1)), np.cumsum(X, axis=1)], axis=1)
+    Q = np.concatenate([np.zeros((len(X), 1)), np.cumsum(X * X, axis=1)], axis=1)
+    n = T - lags
+    sums = S[:, T][:, None] - S[:, lags] - S[:, T - lags]
+    squares = Q[:, T][:, None] - Q[:, lags] + Q[:, T - lags] - 2 * cross
+    variances = squares / n - (sums / n) ** 2
+    log_tau = 0.25 * np.log10(variances)
+    log_lags = np.log10(lags) - np.log10(lags).mean()
+    hurst = 2.0 * log_tau.dot(log_lags) / log_lags.dot(log_lags)
+    return hurst if spreads.ndim > 1 else hurst[0]
+
+def get_shapiro_pvalue(spreads):
+    from scipy.stats import shapiro
+    w, p = shapiro(spreads)
+    return p
+
+#statsmodels backend: the library calls the NumPy tests reproduce
+def get_sm_coint_pvalues(Y, X):
+    import statsmodels.tsa.stattools as sm
+    return np.array([sm.coint(y, x)[1] for y, x in zip(Y, X)])
+
+def get_sm_adf_pvalue(spreads):
+    import statsmodels.tsa.stattools as sm
+    return sm.adfuller(spreads, 1)[1]
+
+def get_sm_half_life(spreads):
+    import statsmodels.tsa.stattools as sm
     lag = np.roll(spreads, 1)
     lag[0] = 0
     ret = spreads - lag
     ret[0] = 0
-    lag2 = sm.add_constant(lag)
-    model = sm.OLS(ret, lag2)
-    res = model.fit()
+    res = sm.OLS(ret, sm.add_constant(lag)).fit()
     return (-np.log(2) / res.params[1])
 
-def get_hurst_hvalue(spreads):
-    lags = range(2, 100)
-    tau = [np.sqrt(np.std(np.subtract(spreads[lag:], spreads[:-lag]))) for lag in lags]
-    poly = np.polyfit(np.log10(lags), np.log10(tau), 1)
-    return poly[0]*2.0
-
-def get_shapiro_pvalue(spreads):
-    w, p = shapiro(spreads)
-    return p
+#implementations of every test by backend as (function, batched): batched ones take a [pairs x days]
+#stack (coint a Y and an X stack), the others one spread
+TEST_BACKENDS = {'coint': {'numpy': (get_batch_coint_pvalues, True), 'statsmodels': (get_sm_coint_pvalues, True)},
+                 'adf': {'numpy': (get_adf_pvalue, True), 'statsmodels': (get_sm_adf_pvalue, False)},
+                 'half-life': {'numpy': (get_half_life, True), 'statsmodels': (get_sm_half_life, False)},
+                 'hurst': {'numpy': (get_hurst_hvalue, True)},
+                 'sw': {'scipy': (get_shapiro_pvalue, False)}}
+
+#backend of a test: TEST_BACKEND, or its only one
+def get_test_backend_name(stage):
+    backends = TEST_BACKENDS[stage]
+    if TEST_BACKEND in backends:
+        return TEST_BACKEND
+    return list(backends)[0]
+
+#implementation of a test in TEST_BACKEND, or its only one
+def get_test_backend(stage):
+    return TEST_BACKENDS[stage][get_test_backend_name(stage)]
+
+def load_statsmodels():
+    import statsmodels.tsa.stattools
+
+def load_scipy():
+    import scipy.stats
+
+BACKEND_LOADERS = {'statsmodels': load_statsmodels, 'scipy': load_scipy}
+
+#import the libraries of the enabled tests' backends before screening, so the first timed test
+#is not charged for the import and the adaptive test order is not skewed by it
+def load_test_backends():
+    enabled = [(RUN_COINTEGRATION_TEST, 'coint'), (RUN_ADFULLER_TEST, 'adf'), (RUN_HURST_TEST, 'hurst'),
+               (RUN_HALF_LIFE_TEST, 'half-life'), (RUN_SHAPIROWILKE_TEST, 'sw')]
+    for run_test, stage in enabled:
+        loader = BACKEND_LOADERS.get(get_test_backend_name(stage))
+        if run_test and loader is not None:
+            loader()
 
 #OUT OF ORDER*****************************************************************************************
 def sample_comparison_test(context, data):
@@ -252,8 +1044,8 @@ def sample_comparison_test(context, data):
     empty_data(context)
 
     context.universe_pool = pd.Index([])
+    records = []
     for pair in SAMPLE_UNIVERSE:
-        context.coint_pairs[pair] = {}
         context.universe_pool.append(pd.Index([pair[0], pair[1]]))
         s1_price = get_price_history(data, pair[0], COINT_LOOKBACK)
         s2_price = get_price_history(data, pair[1], COINT_LOOKBACK)
@@ -281,52 +1073,275 @@ def sample_comparison_test(context, data):
         except:
             log.warn("Unable to calculate Shaprio-Wilke p-value")
 
-        context.coint_pairs[pair]['corr'] = corr
-        context.coint_pairs[pair]['coint'] = coint_pos
-        context.coint_pairs[pair]['adf'] = adf_p
-        context.coint_pairs[pair]['half-life'] = hl
-        context.coint_pairs[pair]['hurst'] = hurst_h
-        context.coint_pairs[pair]['sw'] = sw
+        records.append(PairRecord(pair[0], pair[1], 0, {'corr': corr, 'coint': coint_pos, 'adf': adf_p,
+                                                       'half-life': hl, 'hurst': hurst_h, 'sw': sw}))
 
     context.target_weights = get_current_portfolio_weights(context, data)
     empty_target_weights(context)
 
-    context.real_yield_keys = sorted(context.coint_pairs, key=lambda kv: context.coint_pairs[kv]['coint'], reverse=False)
-
-    temp_real_yield_keys = context.real_yield_keys
-    for pair in temp_real_yield_keys:
-        if (pair[0] in context.total_stock_list) or (pair[1] in context.total_stock_list):
-            context.real_yield_keys.remove(pair)
-            del context.coint_pairs[pair]
-        else:
-            context.total_stock_list.append(pair[0])
-            context.total_stock_list.append(pair[1])
-
-    if (context.num_pairs > len(context.real_yield_keys)):
-        context.num_pairs = len(context.real_yield_keys) 
-    for i in range(context.num_pairs):
-        context.top_yield_pairs.append(context.real_yield_keys[i])
-        coint = context.coint_pairs[context.real_yield_keys[i]]['coint']
-        corr = context.coint_pairs[context.real_yield_keys[i]]['corr']
-        adf_p = context.coint_pairs[context.real_yield_keys[i]]['adf']
-        hl = context.coint_pairs[context.real_yield_keys[i]]['half-life']
-        hurst_h = context.coint_pairs[context.real_yield_keys[i]]['hurst']
-
-        print("TOP PAIR " + str(i+1) + ": " + str(context.real_yield_keys[i]) 
-              + "\n\t\t\tcorrelation: \t" + str(round(corr,3)) 
-              + "\n\t\t\tcointegration: \t" + str(coint)
-              + "\n\t\t\tadf p-value: \t" + str(adf_p)
-              + "\n\t\t\thalf-life: \t" + str(hl)
-              + "\n\t\t\thurst h-value: \t" + str(hurst_h) + "\n")
-    for pair in context.top_yield_pairs:
-        context.pair_status[pair] = {}
-        context.pair_status[pair]['currently_short'] = False
-        context.pair_status[pair]['currently_long'] = False
+    context.pairs = select_pairs(records, 'coint', context.num_pairs)
+    context.num_pairs = len(context.pairs.records)
+    context.pairs.select(context.num_pairs)
+    for i, record in enumerate(context.pairs.records[:context.num_pairs]):
+        print("TOP PAIR " + str(i+1) + ": " + str((record.y, record.x))
+              + "\n\t\t\tcorrelation: \t" + str(round(record.corr,3)) 
+              + "\n\t\t\tcointegration: \t" + str(record.coint)
+              + "\n\t\t\tadf p-value: \t" + str(record.adf)
+              + "\n\t\t\thalf-life: \t" + str(record.half_life)
+              + "\n\t\t\thurst h-value: \t" + str(record.hurst) + "\n")
 
     context.universe_set = True
-    context.spread = np.ndarray((context.num_pairs, 0))
+    context.spread = SpreadWindow(context.num_pairs, Z_WINDOW)
+    context.hedges = None
+    context.stream = None
 #*************************************************************************************************************
 
+#per-sector counters of the screening cascade: candidates entering and surviving each stage,
+#wall time per stage and how often a test fell back to 'N/A'
+class ScreeningStats(object):
+    STAGES = ['corr', 'coint', 'adf', 'hurst', 'half-life', 'sw', 'spreads', 'cache']
+
+    def __init__(self):
+        self.entered = dict((stage, 0) for stage in self.STAGES)
+        self.passed = dict((stage, 0) for stage in self.STAGES)
+        self.seconds = dict((stage, 0.0) for stage in self.STAGES)
+        self.fallbacks = dict((stage, 0) for stage in self.STAGES)
+
+    def count(self, stage, entered, passed):
+        self.entered[stage] += int(entered)
+        self.passed[stage] += int(passed)
+        return passed
+
+    def timed(self, stage, function, *args):
+        started = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.seconds[stage] += time.time() - started
+
+    #run one statistical test on a spread, 'N/A' (logged and counted) if it cannot be computed
+    def test(self, stage, function, spreads, pair):
+        started = time.time()
+        try:
+            return self.checked(stage, function(spreads), pair)
+        except:
+            return self.fallback(stage, pair)
+        finally:
+            self.seconds[stage] += time.time() - started
+
+    #a test value as is, or 'N/A' (logged and counted) if it is nan or infinite: the NumPy tests
+    #return those where statsmodels raised on a singular regression
+    def checked(self, stage, value, pair):
+        if np.isfinite(value):
+            return value
+        return self.fallback(stage, pair)
+
+    def fallback(self, stage, pair):
+        self.fallbacks[stage] += 1
+        log.warn("Unable to calculate " + TEST_NAMES[stage] + " for pair " + str(pair))
+        return 'N/A'
+
+    def merge(self, other):
+        for stage in self.STAGES:
+            self.entered[stage] += other.entered[stage]
+            self.passed[stage] += other.passed[stage]
+            self.seconds[stage] += other.seconds[stage]
+            self.fallbacks[stage] += other.fallbacks[stage]
+
+    def as_record(self):
+        return {'stages': [{'stage': stage, 'entered': self.entered[stage], 'passed': self.passed[stage],
+                            'seconds': round(self.seconds[stage], 6), 'fallbacks': self.fallbacks[stage]}
+                           for stage in self.STAGES],
+                'seconds': round(sum(self.seconds.values()), 6)}
+
+TEST_NAMES = {'adf': 'ADFuller p-value', 'hurst': 'Hurst h-value', 'half-life': 'half-life',
+              'sw': 'Shapiro-Wilke p-value'}
+
+#a test value within (low, high); a test that fell back to 'N/A' never passes
+def in_range(value, low, high):
+    return value != 'N/A' and low < value < high
+
+#one per-spread test of the cascade: the record key it fills, the spread lookback it runs on
+#and the open interval its value must fall in
+#a batched test takes the [candidates x days] spread matrix and falls back to one spread at a time
+#if the batch fails
+class SpreadFilter(object):
+    def __init__(self, stage, lookback, test, low, high, batched=False):
+        self.stage = stage
+        self.lookback = lookback
+        self.test = test
+        self.low = low
+        self.high = high
+        self.batched = batched
+
+    #test every (s1, s2, record) candidate, returns the ones that pass
+    def apply(self, prices, candidates, spread_cache, stats):
+        spreads = stats.timed('spreads', spread_cache.get, prices, [(s1, s2) for s1, s2, record in candidates],
+                              self.lookback)
+        values = None
+        if self.batched:
+            try:
+                values = [stats.checked(self.stage, value, (s1, s2))
+                          for value, (s1, s2, record) in zip(stats.timed(self.stage, self.test, np.array(spreads)),
+                                                             candidates)]
+            except:
+                values = None
+        if values is None:
+            values = [stats.test(self.stage, self.test, spreads[n], (s1, s2))
+                      for n, (s1, s2, record) in enumerate(candidates)]
+        passed = []
+        for (s1, s2, record), value in zip(candidates, values):
+            record[self.stage] = value
+            if in_range(value, self.low, self.high):
+                passed.append((s1, s2, record))
+        stats.count(self.stage, len(candidates), len(passed))
+        return passed
+
+#the enabled per-spread filters in their fixed order (built per call so flag and TEST_BACKEND changes are seen)
+def get_spread_filters():
+    filters = [(RUN_ADFULLER_TEST, 'adf', ADF_LOOKBACK, -np.inf, ADF_P_MAX),
+               (RUN_HURST_TEST, 'hurst', HURST_LOOKBACK, HURST_H_MIN, HURST_H_MAX),
+               (RUN_HALF_LIFE_TEST, 'half-life', HALF_LIFE_LOOKBACK, HALF_LIFE_MIN, HALF_LIFE_MAX),
+               (RUN_SHAPIROWILKE_TEST, 'sw', SHAPIROWILKE_LOOKBACK, -np.inf, SHAPIROWILKE_P_MIN)]
+    spread_filters = []
+    for enabled, stage, lookback, low, high in filters:
+        if enabled:
+            test, batched = get_test_backend(stage)
+            spread_filters.append(SpreadFilter(stage, lookback, test, low, high, batched))
+    return spread_filters
+
+#order conjunctive filters by cost per candidate over rejection rate, which minimizes the expected
+#cost of screening one candidate; measured on past rebalances, the fixed order until every filter has run
+def order_spread_filters(filters, history):
+    if not ADAPTIVE_TEST_ORDER or history is None:
+        return filters
+    if min([history.entered[spread_filter.stage] for spread_filter in filters] + [1]) == 0:
+        return filters
+    def expected_cost(spread_filter):
+        entered = history.entered[spread_filter.stage]
+        cost = history.seconds[spread_filter.stage] / entered
+        reject = (entered - history.passed[spread_filter.stage] + 1.0) / (entered + 2.0)
+        return cost / reject
+    return sorted(filters, key=expected_cost)
+
+#run the screening cascade on one sector's [dates x assets] price matrix,
+#returns the records of every tested ordered pair and the pairs that passed all tests;
+#the per-spread filters run in the given order of stage names (fixed order by default);
+#with a PairStatsCache, pairs it still holds as far-off rejections are not re-tested
+def screen_sector(prices, spread_cache, stats, order=None, pair_stats=None):
+    coint_data = {}
+    coint_pairs = {}
+    #correlation prefilter: coint only runs on pairs the correlation test would keep
+    corr_matrix = stats.timed('corr', get_correlation_matrix, prices.iloc[-COINT_LOOKBACK:])
+    candidates = stats.timed('corr', get_correlated_pairs, corr_matrix)
+    size = prices.shape[1]
+    stats.count('corr', size * (size - 1) // 2, len(candidates))
+    if pair_stats is not None:
+        pair_stats.load(prices)
+    tested = []
+    for i, j in candidates:
+        for k, l in [(i, j), (j, i)]:
+            s1, s2 = prices.columns[k], prices.columns[l]
+            record = pair_stats.reuse(s1, s2) if pair_stats is not None else None
+            if record is None:
+                tested.append((k, l))
+            else:
+                coint_data[(s1,s2)] = record
+    stats.count('cache', 2 * len(candidates), 2 * len(candidates) - len(tested))
+    #every direction still to test in one batched Engle-Granger run
+    tested = np.array(tested, dtype=int).reshape(-1, 2)
+    coint_prices = prices.iloc[-COINT_LOOKBACK:].values.T
+    coint_pvalues = stats.timed('coint', get_test_backend('coint')[0],
+                                coint_prices[tested[:, 0]], coint_prices[tested[:, 1]])
+    survivors = []
+    for (k, l), coint_pvalue in zip(tested, coint_pvalues):
+        s1, s2 = prices.columns[k], prices.columns[l]
+        coint_data[(s1,s2)] = {"corr": corr_matrix[k, l], "coint": coint_pvalue,
+                               "adf": 'N/A', "hurst": 'N/A', "half-life": 'N/A', "sw": 'N/A'}
+        if RUN_COINTEGRATION_TEST and not stats.count('coint', 1, coint_pvalue < COINT_P_MAX):
+            continue
+        survivors.append((s1, s2, coint_data[(s1,s2)]))
+    #the filters are conjunctive, so their order changes the cost but never the accepted set
+    filters = dict((spread_filter.stage, spread_filter) for spread_filter in get_spread_filters())
+    order = order or [stage for stage in ScreeningStats.STAGES if stage in filters]
+    for stage in order:
+        if survivors:
+            survivors = filters[stage].apply(prices, survivors, spread_cache, stats)
+    for s1, s2, record in survivors:
+        coint_pairs[(s1,s2)] = record
+    if pair_stats is not None:
+        bounds = [(stage, (filters[stage].low, filters[stage].high)) for stage in order]
+        if RUN_COINTEGRATION_TEST:
+            bounds.insert(0, ('coint', (-np.inf, COINT_P_MAX)))
+        for k, l in tested:
+            s1, s2 = prices.columns[k], prices.columns[l]
+            pair_stats.store(s1, s2, coint_data[(s1,s2)], bounds)
+    return coint_data, coint_pairs
+
+#screening worker: rebuild a sector matrix from shared memory and screen it with positional columns,
+#only the records of pairs that passed are sent back
+def screen_sector_worker(task):
+    from multiprocessing import shared_memory
+    name, shape, order = task
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        prices = pd.DataFrame(np.ndarray(shape, dtype=float, buffer=block.buf))
+        spread_cache = SpreadCache()
+        stats = ScreeningStats()
+        coint_data, coint_pairs = screen_sector(prices, spread_cache, stats, order)
+        del prices, spread_cache.spreads, coint_data
+        passed = dict(((int(s1), int(s2)), record) for (s1, s2), record in coint_pairs.items())
+        return passed, stats, spread_cache.hits, spread_cache.misses
+    finally:
+        block.close()
+
+#screen sectors across a process pool, prices shared with the workers instead of pickled
+def screen_sectors_parallel(sector_prices, spread_cache, order=None):
+    import multiprocessing
+    from multiprocessing import shared_memory
+    blocks = {}
+    results = {}
+    try:
+        for code, prices in sector_prices.items():
+            values = np.ascontiguousarray(prices.values, dtype=float)
+            blocks[code] = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=float, buffer=blocks[code].buf)[:] = values
+        #largest sectors first so the pool is not left waiting on a straggler
+        codes = sorted(sector_prices, key=lambda code: -sector_prices[code].shape[1])
+        tasks = [(blocks[code].name, sector_prices[code].shape, order) for code in codes]
+        pool = multiprocessing.get_context('fork').Pool(SCREEN_PROCESSES)
+        try:
+            outputs = pool.map(screen_sector_worker, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for code, (passed, stats, hits, misses) in zip(codes, outputs):
+            columns = sector_prices[code].columns
+            results[code] = (dict(((columns[i], columns[j]), record) for (i, j), record in passed.items()), stats)
+            spread_cache.hits += hits
+            spread_cache.misses += misses
+    finally:
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+    return results
+
+#screening price matrix of some stocks, from the price cache when enabled
+def get_screening_prices(context, data, stocks):
+    if PRICE_CACHE_SIZE > 0:
+        return context.price_cache.get(data, stocks, SCREEN_LOOKBACK, PREFETCH_THREADS)
+    return fetch_price_matrix(data, stocks, SCREEN_LOOKBACK, PREFETCH_THREADS)
+
+#warm the price cache with the histories of the current pipeline ahead of a rebalance month
+def prefetch_prices(context, data):
+    next_month = get_datetime('US/Eastern').month % 12 + 1
+    if context.interval_mod >= 0 and (next_month % INTERVAL) != context.interval_mod:
+        return
+    stocks = algo.pipeline_output('pairs').index
+    started = time.time()
+    context.price_cache.get(data, stocks, SCREEN_LOOKBACK, PREFETCH_THREADS)
+    log.info("Prefetched " + str(len(stocks)) + " price histories in " + str(round(time.time() - started, 3)) + "s")
+
 def choose_pairs(context, data):
     this_month = get_datetime('US/Eastern').month 
     if context.interval_mod < 0:
@@ -337,10 +1352,18 @@ def choose_pairs(context, data):
     context.num_pairs = DESIRED_PAIRS
 
     empty_data(context)
+    pipeline_output = algo.pipeline_output('pairs')
+    if CANDIDATE_MODE == 'cluster':
+        #one history call for the whole universe, its clusters stand in for the industry codes
+        universe_prices = get_screening_prices(context, data, pipeline_output.index)
+        clusters = get_clusters(universe_prices.iloc[-COINT_LOOKBACK:]) or [np.arange(0)]
+        context.codes = list(range(len(clusters)))
+        context.universes = dict((code, {'universe': universe_prices.columns[members]})
+                                 for code, members in enumerate(clusters))
     size_str = ""
     for code in context.codes:
-        context.universes[code]['universe'] = algo.pipeline_output(str(code))
-        context.universes[code]['universe'] = context.universes[code]['universe'].index
+        if CANDIDATE_MODE != 'cluster':
+            context.universes[code]['universe'] = pipeline_output.index[(pipeline_output['sector'] == code).values]
         context.universes[code]['size'] = len(context.universes[code]['universe'])
         if context.universes[code]['size'] > 1:
             context.universe_set = True
@@ -348,285 +1371,156 @@ def choose_pairs(context, data):
     print ("CHOOSING PAIRS...\nUniverse sizes:" + size_str)
     context.universe_pool = context.universes[context.codes[0]]['universe']
     for code in context.codes:
-        context.universe_pool = context.universe_pool | context.universes[code]['universe']
+        context.universe_pool = context.universe_pool.union(context.universes[code]['universe'])
 
     context.target_weights = get_current_portfolio_weights(context, data)
     empty_target_weights(context)
     #context.spread = np.ndarray((context.num_pairs, 0))
 
     #SCREENING
+    #one [dates x assets] history call per sector, every test slices views of it
+    sector_prices = {}
     for code in context.codes:
-        for i in range (context.universes[code]['size']):
-            for j in range (i+1, context.universes[code]['size']):
-                s1 = context.universes[code]['universe'][i]
-                s2 = context.universes[code]['universe'][j]
-                s1_price_coint = get_price_history(data, s1, COINT_LOOKBACK)
-                s2_price_coint = get_price_history(data, s2, COINT_LOOKBACK)
-                correlation, coint_pvalue_pos, coint_pvalue_neg = get_corr_coint(data, s1_price_coint,
-                                                                                 s2_price_coint)
-                context.coint_data[(s1,s2)] = {"corr": correlation, "coint": coint_pvalue_pos}
-
-                passed_corr = (not RUN_CORRELATION_TEST) or (abs(correlation) > CORR_MIN)
-                passed_coint = (not RUN_COINTEGRATION_TEST) or (coint_pvalue_pos < COINT_P_MAX)
-
-                if (passed_corr and passed_coint):
-                    adf_p = 'N/A'
-                    hurst_h = 'N/A'
-                    hl = 'N/A'
-                    sw = 'N/A'
-                    
-                    s1_price_adf = s1_price_coint
-                    s2_price_adf = s2_price_coint
-                    s1_price_hurst = s1_price_coint
-                    s2_price_hurst = s2_price_coint
-                    s1_price_hl = s1_price_coint
-                    s2_price_hl = s2_price_coint
-                    s1_price_sw = s1_price_coint
-                    s2_price_sw = s2_price_coint
-                    
-                    if RUN_ADFULLER_TEST:
-                        if ADF_LOOKBACK != COINT_LOOKBACK:
-                            s1_price_adf = get_price_history(data, s1, ADF_LOOKBACK)
-                            s2_price_adf = get_price_history(data, s2, ADF_LOOKBACK)
-                        spreads = get_spreads(data, s1_price_adf, s2_price_adf, ADF_LOOKBACK)
-                        try:
-                            adf_p = get_adf_pvalue(spreads)
-                        except:
-                            log.warn("Unable to calculate ADFuller p-value for pair " + str((s1,s2)))
-                    context.coint_data[(s1,s2)]['adf'] = adf_p
-                    if (not RUN_ADFULLER_TEST) or (adf_p < ADF_P_MAX):
-                        if RUN_HURST_TEST:
-                            if HURST_LOOKBACK != COINT_LOOKBACK:
-                                s1_price_hurst = get_price_history(data, s1, HURST_LOOKBACK)
-                                s2_price_hurst = get_price_history(data, s2, HURST_LOOKBACK)
-                            spreads = get_spreads(data, s1_price_hurst, s2_price_hurst, HURST_LOOKBACK)
-                            try:
-                                hurst_h = get_hurst_hvalue(spreads)
-                            except:
-                                log.warn("Unable to calculate Hurst h-value for pair " + str((s1,s2)))
-                        context.coint_data[(s1,s2)]['hurst'] = hurst_h
-                        if (not RUN_HURST_TEST) or (hurst_h < HURST_H_MAX and hurst_h > HURST_H_MIN):
-                            if RUN_HALF_LIFE_TEST:
-                                if HALF_LIFE_LOOKBACK != COINT_LOOKBACK:
-                                    s1_price_hl = get_price_history(data, s1, HALF_LIFE_LOOKBACK)
-                                    s2_price_hl = get_price_history(data, s2, HALF_LIFE_LOOKBACK)
-                                spreads = get_spreads(data, s1_price_hl, s2_price_hl, HALF_LIFE_LOOKBACK)
-                                try:
-                                    hl = get_half_life(spreads)
-                                except:
-                                    log.warn("Unable to calculate half-life for pair " + str((s1,s2)))
-                            context.coint_data[(s1,s2)]['half-life'] = hl
-                            if (not RUN_HALF_LIFE_TEST) or (hl > HALF_LIFE_MIN and hl < HALF_LIFE_MAX):
-                                if RUN_SHAPIROWILKE_TEST:
-                                    if SHAPIROWILKE_LOOKBACK != COINT_LOOKBACK:
-                                        s1_price_sw = get_price_history(data, s1, SHAPIROWILKE_LOOKBACK)
-                                        s2_price_sw = get_price_history(data, s2, SHAPIROWILKE_LOOKBACK)
-                                    spreads = get_spreads(data, s1_price_sw, s2_price_sw, SHAPIROWILKE_LOOKBACK)
-                                    try:
-                                        sw = get_shapiro_pvalue(spreads)
-                                    except:
-                                        log.warn("Unable to calculate Shapiro-Wilke p-value for pair " 
-                                                 + str((s1,s2)))
-                                context.coint_data[(s1,s2)]['sw'] = sw
-                                if (not RUN_SHAPIROWILKE_TEST) or (sw < SHAPIROWILKE_P_MIN):
-                                    context.coint_pairs[(s1,s2)] = context.coint_data[(s1,s2)]
-
-                #TEST REVERSE
-                context.coint_data[(s2,s1)] = {"corr": correlation, "coint": coint_pvalue_neg}
-                passed_corr = (not RUN_CORRELATION_TEST) or (abs(correlation) > CORR_MIN)
-                passed_coint = (not RUN_COINTEGRATION_TEST) or (coint_pvalue_pos < COINT_P_MAX)
-                if (passed_corr and passed_coint):
-                    adf_p = 'N/A'
-                    hurst_h = 'N/A'
-                    hl = 'N/A'
-                    sw = 'N/A'
-                    
-                    s1_price_adf = s1_price_coint
-                    s2_price_adf = s2_price_coint
-                    s1_price_hurst = s1_price_coint
-                    s2_price_hurst = s2_price_coint
-                    s1_price_hl = s1_price_coint
-                    s2_price_hl = s2_price_coint
-                    s1_price_sw = s1_price_coint
-                    s2_price_sw = s2_price_coint
-                    
-                    if RUN_ADFULLER_TEST:
-                        if ADF_LOOKBACK != COINT_LOOKBACK:
-                            s2_price_adf = get_price_history(data, s2, ADF_LOOKBACK)
-                            s1_price_adf = get_price_history(data, s1, ADF_LOOKBACK)
-                        spreads = get_spreads(data, s2_price_adf, s1_price_adf, ADF_LOOKBACK)
-                        try:
-                            adf_p = get_adf_pvalue(spreads)
-                        except:
-                            log.warn("Unable to calculate ADFuller p-value for pair " + str((s2,s1)))
-                    context.coint_data[(s2,s1)]['adf'] = adf_p
-                    if (not RUN_ADFULLER_TEST) or (adf_p < ADF_P_MAX):
-                        if RUN_HURST_TEST:
-                            if HURST_LOOKBACK != COINT_LOOKBACK:
-                                s2_price_hurst = get_price_history(data, s2, HURST_LOOKBACK)
-                                s1_price_hurst = get_price_history(data, s1, HURST_LOOKBACK)
-                            spreads = get_spreads(data, s2_price_hurst, s1_price_hurst, HURST_LOOKBACK)
-                            try:
-                                hurst_h = get_hurst_hvalue(spreads)
-                            except:
-                                log.warn("Unable to calculate Hurst h-value for pair " + str((s2,s1)))
-                        context.coint_data[(s2,s1)]['hurst'] = hurst_h
-                        if (not RUN_HURST_TEST) or (hurst_h < HURST_H_MAX and hurst_h > HURST_H_MIN):
-                            if RUN_HALF_LIFE_TEST:
-                                if HALF_LIFE_LOOKBACK != COINT_LOOKBACK:
-                                    s2_price_hl = get_price_history(data, s2, HALF_LIFE_LOOKBACK)
-                                    s1_price_hl = get_price_history(data, s1, HALF_LIFE_LOOKBACK)
-                                spreads = get_spreads(data, s2_price_hl, s1_price_hl, HALF_LIFE_LOOKBACK)
-                                try:
-                                    hl = get_half_life(spreads)
-                                except:
-                                    log.warn("Unable to calculate half-life for pair " + str((s2,s1)))
-                            context.coint_data[(s2,s1)]['half-life'] = hl
-                            if (not RUN_HALF_LIFE_TEST) or (hl > HALF_LIFE_MIN and hl < HALF_LIFE_MAX):
-                                if RUN_SHAPIROWILKE_TEST:
-                                    if SHAPIROWILKE_LOOKBACK != COINT_LOOKBACK:
-                                        s2_price_sw = get_price_history(data, s2, SHAPIROWILKE_LOOKBACK)
-                                        s1_price_sw = get_price_history(data, s1, SHAPIROWILKE_LOOKBACK)
-                                    spreads = get_spreads(data, s2_price_sw, s1_price_sw, SHAPIROWILKE_LOOKBACK)
-                                    try:
-                                        sw = get_shapiro_pvalue(spreads)
-                                    except:
-                                        log.warn("Unable to calculate Shapiro-Wilke p-value for pair " 
-                                                 + str((s2,s1)))
-                                context.coint_data[(s2,s1)]['sw'] = sw
-                                if (not RUN_SHAPIROWILKE_TEST) or (sw < SHAPIROWILKE_P_MIN):
-                                    context.coint_pairs[(s2,s1)] = context.coint_data[(s2,s1)]
-    #sort pairs from highest to lowest cointegrations
-    rev = False
-    if RANK_BY == 'corr':
-        rev = True
-    context.real_yield_keys = sorted(context.coint_pairs, key=lambda kv: context.coint_pairs[kv][RANK_BY],
-                                     reverse=rev)
-
-    temp_real_yield_keys = context.real_yield_keys
-    for pair in temp_real_yield_keys:
-        if (pair[0] in context.total_stock_list) or (pair[1] in context.total_stock_list):
-            context.real_yield_keys.remove(pair)
-            del context.coint_pairs[pair]
-        else:
-            context.total_stock_list.append(pair[0])
-            context.total_stock_list.append(pair[1])
-
-    #select top num_pairs pairs
-    if (context.num_pairs > len(context.real_yield_keys)):
-        context.num_pairs = len(context.real_yield_keys)
-    for i in range(context.num_pairs):
-        context.top_yield_pairs.append(context.real_yield_keys[i])
-        u_code = 0
-        for code in context.codes:
-            if context.real_yield_keys[i][0] in context.universes[code]['universe']:
-                u_code = code
-        coint = context.coint_pairs[context.real_yield_keys[i]]['coint']
-        corr = context.coint_pairs[context.real_yield_keys[i]]['corr']
-        adf_p = context.coint_pairs[context.real_yield_keys[i]]['adf']
-        hl = context.coint_pairs[context.real_yield_keys[i]]['half-life']
-        hurst_h = context.coint_pairs[context.real_yield_keys[i]]['hurst']
-        sw = context.coint_pairs[context.real_yield_keys[i]]['sw']
-
-        print("TOP PAIR " + str(i+1) + ": " + str(context.real_yield_keys[i]) 
-              + "\n\t\t\tsector: \t" + str(u_code) + "\n\t\t\tcorrelation: \t" + str(round(corr,3)) 
-              + "\n\t\t\tcointegration: \t" + str(coint) 
-              + "\n\t\t\tadf p-value: \t" + str(adf_p) 
-              + "\n\t\t\thalf-life: \t" + str(hl) 
-              + "\n\t\t\thurst h-value: \t" + str(hurst_h) 
-              + "\n\t\t\tshapiro-wilke p-value: \t" + str(sw)
+        if context.universes[code]['size'] > 1 and CANDIDATE_MODE == 'cluster':
+            sector_prices[code] = universe_prices[context.universes[code]['universe']]
+        elif context.universes[code]['size'] > 1:
+            sector_prices[code] = get_screening_prices(context, data, context.universes[code]['universe'])
+    order = [spread_filter.stage for spread_filter in
+             order_spread_filters(get_spread_filters(), context.filter_stats)]
+    load_test_backends()
+    if PAIR_STATS_SIZE > 0:
+        context.pair_stats.retain(context.universe_pool)
+    if SCREEN_PROCESSES > 1:
+        results = screen_sectors_parallel(sector_prices, context.spread_cache, order)
+    else:
+        results = {}
+        for code in sector_prices:
+            stats = ScreeningStats()
+            coint_data, coint_pairs = screen_sector(sector_prices[code], context.spread_cache, stats, order,
+                                                    context.pair_stats if PAIR_STATS_SIZE > 0 else None)
+            results[code] = (coint_pairs, stats)
+    context.screening_records = []
+    rebalance_date = str(get_datetime('US/Eastern').date())
+    #only the pairs that passed every test are kept, the per-sector records of every tested pair are dropped
+    records = []
+    for code in context.codes:
+        if code in results:
+            records.extend(PairRecord(s1, s2, code, result) for (s1, s2), result in results[code][0].items())
+            context.filter_stats.merge(results[code][1])
+            record = results[code][1].as_record()
+            record.update({'date': rebalance_date, 'code': int(code), 'size': int(context.universes[code]['size']),
+                           'order': order})
+            context.screening_records.append(record)
+            log.info(json.dumps(record, sort_keys=True))
+    print ("Spread cache: " + str(context.spread_cache.hits) + " hits, "
+           + str(context.spread_cache.misses) + " misses")
+    if PAIR_STATS_SIZE > 0:
+        print ("Pair stats cache: " + str(context.pair_stats.hits) + " reused, "
+               + str(context.pair_stats.misses) + " re-tested, " + str(len(context.pair_stats.entries)) + " held")
+    print ("Price cache: " + str(context.price_cache.hits) + " updated, "
+           + str(context.price_cache.misses) + " fetched in full")
+
+    #select top num_pairs pairs by RANK_BY, no two sharing a stock
+    context.pairs = select_pairs(records, RANK_BY, context.num_pairs)
+    context.num_pairs = len(context.pairs.records)
+    context.pairs.select(context.num_pairs)
+    for i, record in enumerate(context.pairs.records[:context.num_pairs]):
+        print("TOP PAIR " + str(i+1) + ": " + str((record.y, record.x))
+              + "\n\t\t\tsector: \t" + str(record.code) + "\n\t\t\tcorrelation: \t" + str(round(record.corr,3)) 
+              + "\n\t\t\tcointegration: \t" + str(record.coint) 
+              + "\n\t\t\tadf p-value: \t" + str(record.adf) 
+              + "\n\t\t\thalf-life: \t" + str(record.half_life) 
+              + "\n\t\t\thurst h-value: \t" + str(record.hurst) 
+              + "\n\t\t\tshapiro-wilke p-value: \t" + str(record.sw)
               + "\n")
 
-    for pair in context.top_yield_pairs:
-        context.pair_status[pair] = {}
-        context.pair_status[pair]['currently_short'] = False
-        context.pair_status[pair]['currently_long'] = False
-
-    context.spread = np.ndarray((context.num_pairs, 0))
+    context.spread = SpreadWindow(context.num_pairs, Z_WINDOW)
+    context.hedges = None
+    context.stream = None
+
+#entry/exit transitions of every pair from its z-score and current side, checked in the order
+#exit short, exit long, enter long, enter short; returns boolean masks over the pairs.
+#The thresholds default to ENTRY/EXIT and broadcast, so an offline sweep can pass arrays of them
+def get_transitions(zscores, currently_long, currently_short, entry=None, exit=None):
+    entry = ENTRY if entry is None else entry
+    exit = EXIT if exit is None else exit
+    with np.errstate(invalid='ignore'):
+        exit_short = currently_short & (zscores < exit)
+        exit_long = currently_long & (zscores > -exit) & ~exit_short
+        unchanged = ~(exit_short | exit_long)
+        enter_long = unchanged & (zscores < -entry) & ~currently_long
+        enter_short = unchanged & (zscores > entry) & ~currently_short & ~enter_long
+    return exit_short | exit_long, enter_long, enter_short
 
 def check_pair_status(context, data):
-    if (not context.universe_set):
+    if (not context.universe_set) or not context.pairs.pairs:
         return
 
-    new_spreads = np.ndarray((context.num_pairs, 1))
-    numPairs = context.num_pairs
-    for i in range(numPairs):
-        pair = context.top_yield_pairs[i]
-        # print pair
-        s1 = pair[0]
-        s2 = pair[1]
-
-        s1_price = data.history(s1, 'price', 35, '1d').iloc[-HEDGE_LOOKBACK::]
-        s2_price = data.history(s2, 'price', 35, '1d').iloc[-HEDGE_LOOKBACK::]
-
-        try:
-            hedge = hedge_ratio(s1_price, s2_price, add_const=True)      
-        except ValueError as e:
-            log.debug(e)
-            return
+    #score every pair in one pass against the window before today's spreads enter it
+    prices = update_hedges(context, data)
+    pairs = context.pairs.pairs
+    y_prices = np.array([prices[pair[0]] for pair in pairs], dtype=float)
+    x_prices = np.array([prices[pair[1]] for pair in pairs], dtype=float)
+    hedges = context.hedges.beta()
+    ready = context.spread.count > Z_WINDOW
+    zscores = context.spread.zscores()
+    context.spread.push(y_prices - hedges * x_prices)
+    if not ready:
+        return
+    trade_transitions(context, data, zscores, hedges, y_prices, x_prices)
 
-        context.target_weights = get_current_portfolio_weights(context, data)
-        new_spreads[i, :] = s1_price[-1] - hedge * s2_price[-1]  
-        if context.spread.shape[1] > Z_WINDOW:
-  
-            spreads = context.spread[i, -Z_WINDOW:]
-            zscore = (spreads[-1] - spreads.mean()) / spreads.std()
-
-            if context.pair_status[pair]['currently_short'] and zscore < EXIT:
-                context.target_weights[s1] = 0.0
-                context.target_weights[s2] = 0.0
-                context.pair_status[pair]['currently_short'] = False
-                context.pair_status[pair]['currently_long'] = False
-                #set_pair_status(context, data, s1,s2,s1_price,s2_price, 0, 0, False, False)
-                if not RECORD_LEVERAGE:
-                    record(Y_pct=0, X_pct=0)
-                allocate(context, data)
-                return
+#SIGNAL_MODE = 'minute': step every selected pair with this bar's prices and trade on its z-score;
+#the stream is seeded from one bar history after each selection
+def stream_pair_status(context, data):
+    if not context.universe_set or not context.pairs.pairs:
+        return
+    if context.stream is None:
+        stocks = list(set([stock for pair in context.pairs.pairs for stock in pair]))
+        #the bars before this one: HEDGE_LOOKBACK seed the hedges, Z_WINDOW + 1 spreads fill the window
+        history = data.history(stocks, 'price', HEDGE_LOOKBACK + Z_WINDOW + 2, '1m').iloc[:-1]
+        context.stream = PairStream(context.pairs.pairs, history)
+    prices = data.current(context.stream.stocks, 'price')
+    zscores, hedges, y_prices, x_prices = context.stream.step(np.asarray(prices, dtype=float))
+    trade_transitions(context, data, zscores, hedges, y_prices, x_prices)
+
+#enter and exit pairs on their z-scores, one target-weight vector and optimizer call for all of them
+def trade_transitions(context, data, zscores, hedges, y_prices, x_prices):
+    pairs = context.pairs.pairs
+    currently_long = context.pairs.currently_long
+    currently_short = context.pairs.currently_short
+    exits, enter_long, enter_short = get_transitions(zscores, currently_long, currently_short)
+    changed = exits | enter_long | enter_short
+    if not changed.any():
+        return
+    context.pairs.currently_long = np.where(changed, enter_long, currently_long)
+    context.pairs.currently_short = np.where(changed, enter_short, currently_short)
 
-            if context.pair_status[pair]['currently_long'] and zscore > -EXIT:
-                context.target_weights[s1] = 0.0
-                context.target_weights[s2] = 0.0
-                context.pair_status[pair]['currently_short'] = False
-                context.pair_status[pair]['currently_long'] = False
-                #set_pair_status(context, data, s1,s2,s1_price,s2_price, 0, 0, False, False)
-                if not RECORD_LEVERAGE:
-                    record(Y_pct=0, X_pct=0)
-                allocate(context, data)
-                return
+    #one target-weight vector for all signalling pairs, one optimizer call
+    context.target_weights = get_current_portfolio_weights(context, data)
+    for i in np.flatnonzero(exits):
+        s1, s2 = pairs[i]
+        context.target_weights[s1] = 0.0
+        context.target_weights[s2] = 0.0
+        if not RECORD_LEVERAGE:
+            record(Y_pct=0, X_pct=0)
+
+    for i in np.flatnonzero(enter_long | enter_short):
+        s1, s2 = pairs[i]
+        if enter_long[i]:
+            y_target_shares = 1
+            X_target_shares = -hedges[i]
+        else:
+            y_target_shares = -1
+            X_target_shares = hedges[i]
+        (y_target_pct, x_target_pct) = computeHoldingsPct( y_target_shares, X_target_shares, y_prices[i], x_prices[i] )
 
-            if zscore < -ENTRY and (not context.pair_status[pair]['currently_long']):
-                context.pair_status[pair]['currently_short'] = False
-                context.pair_status[pair]['currently_long'] = True
-                y_target_shares = 1
-                X_target_shares = -hedge
-                (y_target_pct, x_target_pct) = computeHoldingsPct( y_target_shares, X_target_shares, s1_price[-1], s2_price[-1] )
- 
-                context.target_weights[s1] = LEVERAGE * y_target_pct * (1.0/context.num_pairs)
-                context.target_weights[s2] = LEVERAGE * x_target_pct * (1.0/context.num_pairs)
-
-                if not RECORD_LEVERAGE:
-                    record(Y_pct=y_target_pct, X_pct=x_target_pct)
-                #set_pair_status(context,s1,s2,s1_price,s2_price, 1, -hedge, True, False)
-                allocate(context, data)
-                return
+        context.target_weights[s1] = LEVERAGE * y_target_pct * (1.0/context.num_pairs)
+        context.target_weights[s2] = LEVERAGE * x_target_pct * (1.0/context.num_pairs)
 
-            if zscore > ENTRY and (not context.pair_status[pair]['currently_short']):
-                context.pair_status[pair]['currently_short'] = True
-                context.pair_status[pair]['currently_long'] = False
-                y_target_shares = -1
-                X_target_shares = hedge
-                (y_target_pct, x_target_pct) = computeHoldingsPct( y_target_shares, X_target_shares, s1_price[-1], s2_price[-1] )
-                
-                context.target_weights[s1] = LEVERAGE * y_target_pct * (1.0/context.num_pairs)
-                context.target_weights[s2] = LEVERAGE * x_target_pct * (1.0/context.num_pairs)
-
-                if not RECORD_LEVERAGE:
-                    record(Y_pct=y_target_pct, X_pct=x_target_pct)
-                #set_pair_status(context,s1,s2,s1_price,s2_price, -1, hedge, False, True)
-                allocate(context, data)
-                return
+        if not RECORD_LEVERAGE:
+            record(Y_pct=y_target_pct, X_pct=x_target_pct)
 
-    context.spread = np.hstack([context.spread, new_spreads])
+    allocate(context, data)
 
 def allocate(context, data):
     if RECORD_LEVERAGE:
@@ -644,7 +1538,7 @@ def allocate(context, data):
             print(error)
             # context.universe_set = False
             # return
-            partner = get_stock_partner(context, s)
+            partner = context.pairs.get_partner(s)
             if not partner in context.target_weights:
                 context.target_weights = context.target_weights.drop([s])
                 context.universe_pool = context.universe_pool.drop([s])
@@ -672,6 +1566,7 @@ def allocate(context, data):
 
 
 def handle_data(context, data):
-    pass
+    if SIGNAL_MODE == 'minute':
+        stream_pair_status(context, data)
     # if context.account.leverage>LEVERAGE or context.account.leverage < 0:
     #     warn_leverage(context, data)
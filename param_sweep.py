@@ -0,0 +1,202 @@
+#Offline parameter sweep of the check_pair_status trading rule over ENTRY/EXIT/Z_WINDOW/HEDGE_LOOKBACK
+#
+#The daily state machine of pair_trading.py is replayed on the closes of a fixed set of pairs for a
+#whole grid at once: rolling hedges are computed once per HEDGE_LOOKBACK and z-scores once per
+#(HEDGE_LOOKBACK, Z_WINDOW), then every configuration steps through the days together as one row of
+#[configurations x pairs] state. Transitions come from the algorithm's own get_transitions and entry
+#weights from computeHoldingsPct.
+#
+#Model: one decision per day at that day's close, each pair trades a fixed LEVERAGE / pairs share of
+#the starting capital (no compounding), fills pay --slippage-bps and COMMISSION per share with the
+#$1 minimum per order. Costs are charged on the day of the fill, so sharpe and max_drawdown are net.
+#
+#   python param_sweep.py --store DIR --pair KO:PEP --pair XOM:CVX --entry 0.5 1 1.5 --exit 0 0.2 0.5
+#   python param_sweep.py --store DIR --pair KO:PEP --z-window 10 20 30 --hedge-lookback 20 40 --sort sharpe
+
+import argparse
+import itertools
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import quantopian_local
+
+TRADING_DAYS = 252
+
+
+#rolling OLS slope (with intercept) of Y on X over the window ending at every day, [pairs x days];
+#nan until a full window exists. Series are centred first to keep the cumulative sums well conditioned
+def rolling_hedges(Y, X, window):
+    Y = Y - np.nanmean(Y, axis=1)[:, np.newaxis]
+    X = X - np.nanmean(X, axis=1)[:, np.newaxis]
+
+    def window_sums(values):
+        sums = np.concatenate([np.zeros((len(values), 1)), np.cumsum(values, axis=1)], axis=1)
+        out = np.full(values.shape, np.nan)
+        out[:, window - 1:] = sums[:, window:] - sums[:, :-window]
+        return out
+
+    sum_x, sum_y = window_sums(X), window_sums(Y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ((window * window_sums(X * Y) - sum_x * sum_y) /
+                (window * window_sums(X * X) - sum_x * sum_x))
+
+
+#z-score check_pair_status acts on at every day: the previous day's spread against the window of
+#spreads ending there (population std), nan until more than window spreads have been pushed
+def rolling_zscores(spreads, window, start):
+    centred = spreads - np.nanmean(spreads[:, start:], axis=1)[:, np.newaxis]
+    centred[:, :start] = np.nan
+    sums = np.concatenate([np.zeros((len(spreads), 1)), np.nancumsum(centred, axis=1)], axis=1)
+    squares = np.concatenate([np.zeros((len(spreads), 1)), np.nancumsum(centred * centred, axis=1)], axis=1)
+    zscores = np.full(spreads.shape, np.nan)
+    days = np.arange(start + window + 1, spreads.shape[1])
+    if len(days):
+        mean = (sums[:, days] - sums[:, days - window]) / window
+        variance = (squares[:, days] - squares[:, days - window]) / window - mean * mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zscores[:, days] = (centred[:, days - 1] - mean) / np.sqrt(np.maximum(variance, 0.0))
+    return zscores
+
+
+#valid grid points (EXIT < ENTRY, Z_WINDOW <= HEDGE_LOOKBACK) as (entry, exit, z_window, hedge_lookback)
+def get_grid(entry, exit, z_window, hedge_lookback):
+    return [(e, x, z, h) for e, x, z, h in itertools.product(entry, exit, z_window, hedge_lookback)
+            if x < e and z <= h]
+
+
+#P&L, turnover and costs of every grid point on the closes of the given (y, x) pairs.
+#prices is a [dates x assets] frame; the first max(hedge_lookback) - 1 days only seed the hedges
+def sweep(prices, pairs, entry=None, exit=None, z_window=None, hedge_lookback=None, capital=1e6,
+          slippage_bps=5.0, algorithm=None):
+    algorithm = algorithm or quantopian_local.load_algorithm()
+    grid = get_grid(entry or [algorithm.ENTRY], exit or [algorithm.EXIT], z_window or [algorithm.Z_WINDOW],
+                    hedge_lookback or [algorithm.HEDGE_LOOKBACK])
+    if not grid:
+        raise ValueError('empty grid: every point needs EXIT < ENTRY and Z_WINDOW <= HEDGE_LOOKBACK')
+    Y = np.array([prices[y].values for y, x in pairs], dtype=float)
+    X = np.array([prices[x].values for y, x in pairs], dtype=float)
+    start = max(h for e, x, z, h in grid) - 1
+    if start + 1 >= Y.shape[1]:
+        raise ValueError('need more than max(hedge_lookback) days of prices')
+
+    #shared signal inputs: one hedge series per lookback, one z-score series per (lookback, window)
+    hedges = dict((h, rolling_hedges(Y, X, h)) for h in set(h for e, x, z, h in grid))
+    zscores = {}
+    for h, z in set((h, z) for e, x, z, h in grid):
+        zscores[(h, z)] = rolling_zscores(Y - hedges[h] * X, z, start)
+    hedge_keys = sorted(hedges)
+    z_keys = sorted(zscores)
+    hedge_stack = np.array([hedges[h] for h in hedge_keys])
+    z_stack = np.array([zscores[key] for key in z_keys])
+    hedge_rows = np.array([hedge_keys.index(h) for e, x, z, h in grid])
+    z_rows = np.array([z_keys.index((h, z)) for e, x, z, h in grid])
+    entries = np.array([e for e, x, z, h in grid], dtype=float)[:, np.newaxis]
+    exits = np.array([x for e, x, z, h in grid], dtype=float)[:, np.newaxis]
+
+    configs, num_pairs = len(grid), len(pairs)
+    pair_capital = algorithm.LEVERAGE * capital / num_pairs
+    slip = slippage_bps / 1e4
+    currently_long = np.zeros((configs, num_pairs), dtype=bool)
+    currently_short = np.zeros((configs, num_pairs), dtype=bool)
+    y_shares = np.zeros((configs, num_pairs))
+    x_shares = np.zeros((configs, num_pairs))
+    daily_pnl = np.zeros((configs, Y.shape[1] - start))
+    turnover = np.zeros(configs)
+    commission = np.zeros(configs)
+    slippage = np.zeros(configs)
+    trades = np.zeros(configs, dtype=int)
+
+    for t in range(start, Y.shape[1]):
+        y_price, x_price = Y[:, t], X[:, t]
+        if t > start:
+            daily_pnl[:, t - start] = (np.nan_to_num(y_shares * (y_price - Y[:, t - 1])).sum(axis=1) +
+                                       np.nan_to_num(x_shares * (x_price - X[:, t - 1])).sum(axis=1))
+        exits_now, enter_long, enter_short = algorithm.get_transitions(
+            z_stack[z_rows, :, t], currently_long, currently_short, entries, exits)
+        if not (exits_now.any() or enter_long.any() or enter_short.any()):
+            continue
+        hedge = hedge_stack[hedge_rows, :, t]
+        side = np.where(enter_long, 1.0, -1.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y_pct, x_pct = algorithm.computeHoldingsPct(side, -side * hedge, y_price, x_price)
+        entering = enter_long | enter_short
+        new_y = np.where(exits_now, 0.0, np.where(entering, pair_capital * y_pct / y_price, y_shares))
+        new_x = np.where(exits_now, 0.0, np.where(entering, pair_capital * x_pct / x_price, x_shares))
+        new_y[~np.isfinite(new_y)] = 0.0
+        new_x[~np.isfinite(new_x)] = 0.0
+        traded_y, traded_x = np.abs(new_y - y_shares), np.abs(new_x - x_shares)
+        notional = traded_y * y_price + traded_x * x_price
+        turnover += np.nan_to_num(notional).sum(axis=1)
+        fill_slippage = slip * np.nan_to_num(notional).sum(axis=1)
+        fill_commission = (np.where(traded_y > 0, np.maximum(algorithm.COMMISSION * traded_y, 1.0), 0.0) +
+                           np.where(traded_x > 0, np.maximum(algorithm.COMMISSION * traded_x, 1.0), 0.0)).sum(axis=1)
+        slippage += fill_slippage
+        commission += fill_commission
+        daily_pnl[:, t - start] -= fill_slippage + fill_commission
+        trades += entering.sum(axis=1)
+        y_shares, x_shares = new_y, new_x
+        currently_long = (currently_long & ~exits_now) | enter_long
+        currently_short = (currently_short & ~exits_now) | enter_short
+
+    #daily_pnl is net of the costs of each day's fills
+    net = daily_pnl.sum(axis=1)
+    gross = net + commission + slippage
+    daily_returns = daily_pnl / capital
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.sqrt(TRADING_DAYS) * daily_returns.mean(axis=1) / daily_returns.std(axis=1)
+    equity = capital + np.cumsum(daily_pnl, axis=1)
+    drawdown = (1 - equity / np.maximum.accumulate(equity, axis=1)).max(axis=1)
+    results = pd.DataFrame({'gross_pnl': gross, 'commission': commission, 'slippage': slippage, 'pnl': net,
+                            'return': net / capital, 'sharpe': sharpe, 'max_drawdown': drawdown,
+                            'turnover': turnover / capital, 'trades': trades},
+                           index=pd.MultiIndex.from_tuples(grid, names=['ENTRY', 'EXIT', 'Z_WINDOW',
+                                                                        'HEDGE_LOOKBACK']))
+    return results[['pnl', 'return', 'sharpe', 'max_drawdown', 'gross_pnl', 'commission', 'slippage',
+                    'turnover', 'trades']]
+
+
+#[dates x assets] closes of the pair legs from a price store, with the lookback before start
+def load_pair_prices(store, pairs, start=None, end=None, lookback=0):
+    assets = [store.by_symbol[symbol] for pair in pairs for symbol in pair]
+    dates = store.dates
+    first = dates.searchsorted(pd.Timestamp(start, tz='UTC')) if start else 0
+    last = dates.searchsorted(pd.Timestamp(end, tz='UTC'), side='right') - 1 if end else len(dates) - 1
+    first = max(first - lookback, 0)
+    frame = store.window(list(dict.fromkeys(assets)), last, last - first + 1)
+    frame.columns = [asset.symbol for asset in frame.columns]
+    return frame
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep the pair trading rule over a parameter grid.')
+    parser.add_argument('--store', required=True, help='price store directory (see quantopian_local.py)')
+    parser.add_argument('--pair', action='append', required=True, metavar='Y:X', help='pair of symbols (repeatable)')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--entry', type=float, nargs='+')
+    parser.add_argument('--exit', type=float, nargs='+')
+    parser.add_argument('--z-window', type=int, nargs='+')
+    parser.add_argument('--hedge-lookback', type=int, nargs='+')
+    parser.add_argument('--capital', type=float, default=1e6)
+    parser.add_argument('--slippage-bps', type=float, default=5.0)
+    parser.add_argument('--sort', default='pnl', help='result column to sort by')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    algorithm = quantopian_local.load_algorithm()
+    pairs = [tuple(pair.split(':')) for pair in args.pair]
+    lookback = max(args.hedge_lookback or [algorithm.HEDGE_LOOKBACK]) - 1
+    prices = load_pair_prices(quantopian_local.PriceStore(args.store), pairs, args.start, args.end, lookback)
+    warnings.simplefilter('ignore')
+    results = sweep(prices, pairs, args.entry, args.exit, args.z_window, args.hedge_lookback, args.capital,
+                    args.slippage_bps, algorithm)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(results.sort_values(args.sort, ascending=False).head(args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
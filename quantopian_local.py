@@ -0,0 +1,649 @@
+#Local stand-in for the subset of the Quantopian algorithm API used by pair_trading.py
+#
+#Prices live in a columnar store: one float64 memmap laid out [assets x dates], so every asset's
+#history is contiguous on disk, plus the trading calendar and the asset/industry table.
+#Runs daily bars only: every scheduled function sees the day's close as its current price.
+#
+#   python quantopian_local.py STORE_DIR [--start 2016-01-04] [--end 2018-12-31] [--capital 1e6]
+
+import argparse
+import ast
+import json
+import os
+import sys
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+ALGORITHM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pair_trading.py')
+
+
+class Equity(object):
+    def __init__(self, sid, symbol):
+        self.sid = sid
+        self.symbol = symbol
+
+    def __repr__(self):
+        return 'Equity(%d [%s])' % (self.sid, self.symbol)
+
+    def __hash__(self):
+        return hash(self.sid)
+
+    def __eq__(self, other):
+        return isinstance(other, Equity) and self.sid == other.sid
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.sid < other.sid
+
+    def __reduce__(self):
+        return (Equity, (self.sid, self.symbol))
+
+
+#memory-mapped [assets x dates] close prices with the calendar and the asset table
+class PriceStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.prices = np.load(os.path.join(path, 'prices.npy'), mmap_mode='r')
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(path, 'dates.npy')), tz='UTC')
+        with open(os.path.join(path, 'assets.json')) as f:
+            table = json.load(f)
+        self.assets = [Equity(row['sid'], row['symbol']) for row in table]
+        self.industry_codes = np.array([row['industry_code'] for row in table])
+        self.columns = dict((asset, n) for n, asset in enumerate(self.assets))
+        self.by_symbol = dict((asset.symbol, asset) for asset in self.assets)
+
+    #write a [dates x symbols] close-price frame and its industry codes as a store
+    @staticmethod
+    def write(path, prices, industry_codes):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'prices.npy'), np.ascontiguousarray(prices.values.T, dtype=np.float64))
+        np.save(os.path.join(path, 'dates.npy'), prices.index.values.astype('datetime64[D]'))
+        table = [{'sid': sid, 'symbol': str(symbol), 'industry_code': int(industry_codes[symbol])}
+                 for sid, symbol in enumerate(prices.columns)]
+        with open(os.path.join(path, 'assets.json'), 'w') as f:
+            json.dump(table, f)
+        return PriceStore(path)
+
+    #[length x assets] closes ending at (and including) date index end; like data.history it always
+    #returns length rows, the ones before the first stored date are nan on the preceding business days
+    def window(self, assets, end, length):
+        start = max(end + 1 - length, 0)
+        rows = [self.columns.get(asset, -1) for asset in assets]
+        values = np.full((len(rows), length), np.nan)
+        known = [n for n, row in enumerate(rows) if row >= 0]
+        if known:
+            values[known, length - (end + 1 - start):] = self.prices[[rows[n] for n in known], start:end + 1]
+        dates = self.dates[start:end + 1]
+        if len(dates) < length:
+            padding = pd.bdate_range(end=self.dates[0] - pd.offsets.BDay(), periods=length - len(dates), tz='UTC')
+            dates = padding.append(dates)
+        return pd.DataFrame(values.T, index=dates, columns=list(assets))
+
+
+#pipeline terms: just enough of the expression API for screens, classifier columns and CustomFactors.
+#evaluate(engine, day) gives one value per store asset as of the previous close
+class Term(object):
+    def __init__(self, evaluate):
+        self.evaluate = evaluate
+
+    #[length x assets] values of the term over the days ending at the previous close
+    def window(self, engine, day, length):
+        return np.vstack([self.evaluate(engine, past) for past in range(day - length + 1, day + 1)])
+
+    def __and__(self, other):
+        return Term(lambda engine, day: self.evaluate(engine, day) & other.evaluate(engine, day))
+
+    def __or__(self, other):
+        return Term(lambda engine, day: self.evaluate(engine, day) | other.evaluate(engine, day))
+
+    def __invert__(self):
+        return Term(lambda engine, day: ~self.evaluate(engine, day))
+
+    def __gt__(self, value):
+        return Term(lambda engine, day: self.evaluate(engine, day) > value)
+
+    def __ge__(self, value):
+        return Term(lambda engine, day: self.evaluate(engine, day) >= value)
+
+    def __lt__(self, value):
+        return Term(lambda engine, day: self.evaluate(engine, day) < value)
+
+    def __le__(self, value):
+        return Term(lambda engine, day: self.evaluate(engine, day) <= value)
+
+    def eq(self, value):
+        return Term(lambda engine, day: self.evaluate(engine, day) == value)
+
+    def element_of(self, values):
+        return Term(lambda engine, day: np.in1d(self.evaluate(engine, day), list(values)))
+
+    @property
+    def latest(self):
+        return self
+
+
+class Pipeline(object):
+    def __init__(self, columns=None, screen=None):
+        self.columns = dict(columns or {})
+        self.screen = screen
+
+    def add(self, term, name, overwrite=False):
+        self.columns[name] = term
+
+    def set_screen(self, screen, overwrite=False):
+        self.screen = screen
+
+
+#windowed factor: compute(today, assets, out, *inputs, **params) sees [window_length x masked assets]
+#inputs; with outputs, out is a record array and each output is a term attribute of the factor
+class CustomFactor(Term):
+    inputs = ()
+    outputs = None
+    window_length = 1
+    params = ()
+    mask = None
+
+    def __init__(self, inputs=None, window_length=None, mask=None, **kwargs):
+        if inputs is not None:
+            self.inputs = inputs
+        if window_length is not None:
+            self.window_length = window_length
+        if mask is not None:
+            self.mask = mask
+        self.param_values = dict((name, kwargs[name]) for name in self.params)
+        self.cache = {}
+        for name in self.outputs or []:
+            setattr(self, name, Term(lambda engine, day, name=name: self.evaluate(engine, day)[name]))
+
+    def evaluate(self, engine, day):
+        if day not in self.cache:
+            selected = np.ones(len(engine.store.assets), dtype=bool)
+            if self.mask is not None:
+                selected = np.asarray(self.mask.evaluate(engine, day), dtype=bool)
+            windows = [np.asarray(term.window(engine, day, self.window_length))[:, selected] for term in self.inputs]
+            assets = pd.Index([asset for asset, keep in zip(engine.store.assets, selected) if keep])
+            if self.outputs:
+                out = np.rec.array(np.full(len(assets), np.nan, dtype=[(name, float) for name in self.outputs]))
+                result = np.rec.array(np.full(len(selected), np.nan, dtype=out.dtype))
+            else:
+                out = np.full(len(assets), np.nan)
+                result = np.full(len(selected), np.nan)
+            if len(assets):
+                self.compute(engine.store.dates[day - 1], assets, out, *windows, **self.param_values)
+            result[selected] = out
+            self.cache = {day: result}
+        return self.cache[day]
+
+
+class BoundColumn(Term):
+    def __init__(self, name):
+        self.name = name
+        Term.__init__(self, lambda engine, day: engine.store.prices[:, day - 1])
+
+    def window(self, engine, day, length):
+        start = max(day - length, 0)
+        values = np.asarray(engine.store.prices[:, start:day], dtype=float).T
+        if len(values) < length:
+            values = np.vstack([np.full((length - len(values), values.shape[1]), np.nan), values])
+        return values
+
+
+#a classifier that never changes over the store
+class ConstantColumn(Term):
+    def __init__(self, values):
+        Term.__init__(self, lambda engine, day: values(engine))
+
+    def window(self, engine, day, length):
+        return np.tile(self.evaluate(engine, day), (length, 1))
+
+
+class TargetWeights(object):
+    def __init__(self, weights):
+        self.weights = pd.Series(weights, dtype=float)
+
+
+class MaxGrossExposure(object):
+    def __init__(self, max):
+        self.max = max
+
+
+class Position(object):
+    def __init__(self, asset):
+        self.asset = asset
+        self.amount = 0
+        self.cost_basis = 0.0
+        self.last_sale_price = 0.0
+
+
+class Portfolio(object):
+    def __init__(self, capital):
+        self.cash = capital
+        self.starting_cash = capital
+        self.positions = {}
+        self.portfolio_value = capital
+        self.positions_value = 0.0
+
+
+class Account(object):
+    def __init__(self):
+        self.leverage = 0.0
+
+
+class Context(object):
+    pass
+
+
+class Log(object):
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self.quiet = False
+
+    def emit(self, level, message):
+        if not self.quiet:
+            print('%s %s: %s' % (self.runtime.now.strftime('%Y-%m-%d'), level, message))
+
+    def debug(self, message):
+        pass
+
+    def info(self, message):
+        self.emit('INFO', message)
+
+    def warn(self, message):
+        self.emit('WARN', message)
+
+    warning = warn
+
+    def error(self, message):
+        self.emit('ERROR', message)
+
+
+class DataPortal(object):
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def history(self, assets, fields, bar_count, frequency):
+        if frequency not in ('1d', '1m'):
+            raise ValueError('Unsupported frequency ' + str(frequency))
+        single = isinstance(assets, Equity)
+        window = self.runtime.store.window([assets] if single else list(assets), self.runtime.day, bar_count)
+        return window.iloc[:, 0] if single else window
+
+    def current(self, assets, fields):
+        if isinstance(assets, Equity):
+            return self.runtime.price(assets)
+        assets = list(assets)
+        return pd.Series([self.runtime.price(asset) for asset in assets], index=assets, dtype=float)
+
+    def can_trade(self, asset):
+        return np.isfinite(self.runtime.price(asset))
+
+
+class Schedule(object):
+    def __init__(self, function, date_rule, time_rule):
+        self.function = function
+        self.date_rule = date_rule
+        self.time_rule = time_rule
+
+
+#daily event loop over a PriceStore, exposing the algorithm API as module functions and globals
+class Runtime(object):
+    def __init__(self, store, capital=1e6, quiet=False):
+        self.store = store
+        self.capital = capital
+        self.day = 0
+        self.now = store.dates[0] if store is not None else pd.Timestamp.now(tz='UTC').normalize()
+        self.schedules = []
+        self.symbols = dict(store.by_symbol) if store is not None else {}
+        self.pipelines = {}
+        self.pipeline_cache = {}
+        self.records = {}
+        self.commission_cost = 0.0
+        self.commission_min = 0.0
+        self.slippage_bps = 0.0
+        self.pending = {}
+        self.order_count = 0
+        self.commission_paid = 0.0
+        self.timings = {}
+        self.context = Context()
+        self.context.portfolio = Portfolio(capital)
+        self.context.account = Account()
+        self.data = DataPortal(self)
+        self.log = Log(self)
+        self.log.quiet = quiet
+
+    def price(self, asset):
+        column = self.store.columns.get(asset) if self.store is not None else None
+        if column is None:
+            return np.nan
+        return float(self.store.prices[column, self.day])
+
+    #API exposed to the algorithm -------------------------------------------------------------
+
+    def symbol(self, name):
+        asset = self.symbols.get(name)
+        if asset is None:
+            asset = Equity(-1 - len(self.symbols), name)
+            self.symbols[name] = asset
+        return asset
+
+    def schedule_function(self, function, date_rule=None, time_rule=None, half_days=True):
+        self.schedules.append(Schedule(function, date_rule or every_day(), time_rule or market_open()))
+
+    def record(self, **values):
+        self.records.setdefault(self.now, {}).update(values)
+
+    def get_datetime(self, tz=None):
+        return self.now.tz_convert(tz) if tz else self.now
+
+    def set_slippage(self, model):
+        self.slippage_bps = model.basis_points
+
+    def set_commission(self, model):
+        self.commission_cost = model.cost
+        self.commission_min = model.min_trade_cost
+
+    def attach_pipeline(self, pipeline, name, chunks=None):
+        self.pipelines[name] = pipeline
+        return pipeline
+
+    def pipeline_output(self, name):
+        key = (name, self.day)
+        if key not in self.pipeline_cache:
+            self.pipeline_cache = dict((k, v) for k, v in self.pipeline_cache.items() if k[1] == self.day)
+            self.pipeline_cache[key] = self.run_pipeline(self.pipelines[name])
+        return self.pipeline_cache[key]
+
+    #pipelines see data up to the previous close, as in the hosted engine
+    def run_pipeline(self, pipeline):
+        if self.day == 0:
+            return pd.DataFrame(columns=list(pipeline.columns), index=pd.Index([]))
+        mask = np.ones(len(self.store.assets), dtype=bool)
+        if pipeline.screen is not None:
+            mask = np.asarray(pipeline.screen.evaluate(self, self.day), dtype=bool)
+        assets = [asset for asset, keep in zip(self.store.assets, mask) if keep]
+        columns = dict((name, np.asarray(term.evaluate(self, self.day))[mask])
+                       for name, term in pipeline.columns.items())
+        return pd.DataFrame(columns, index=pd.Index(assets))
+
+    #orders are queued and filled after the calling function returns, like the hosted fills on the next bar
+    def order_target_percent(self, asset, percent):
+        self.pending[asset] = percent
+
+    def order_optimal_portfolio(self, objective, constraints):
+        weights = objective.weights.dropna()
+        for constraint in constraints:
+            if isinstance(constraint, MaxGrossExposure):
+                gross = weights.abs().sum()
+                if gross > constraint.max:
+                    weights = weights * (constraint.max / gross)
+        for asset in self.context.portfolio.positions:
+            self.pending[asset] = 0.0
+        self.pending.update(weights.items())
+
+    #fill queued targets at the current price, with fixed-bps slippage and per-share commission
+    def fill_orders(self):
+        portfolio = self.context.portfolio
+        self.mark_to_market()
+        pending, self.pending = self.pending, {}
+        for asset, weight in pending.items():
+            price = self.price(asset)
+            if not np.isfinite(price) or price <= 0:
+                continue
+            position = portfolio.positions.get(asset) or Position(asset)
+            amount = int(weight * portfolio.portfolio_value / price)
+            delta = amount - position.amount
+            if delta == 0:
+                continue
+            fill = price * (1 + np.sign(delta) * self.slippage_bps / 10000.0)
+            cost = max(abs(delta) * self.commission_cost, self.commission_min)
+            portfolio.cash -= delta * fill + cost
+            self.commission_paid += cost
+            position.cost_basis = fill if position.amount == 0 else position.cost_basis
+            position.amount = amount
+            position.last_sale_price = price
+            self.order_count += 1
+            if amount == 0:
+                portfolio.positions.pop(asset, None)
+            else:
+                portfolio.positions[asset] = position
+        self.mark_to_market()
+
+    #close every position at a store day's prices, as the next rebalance's empty_target_weights would;
+    #returns the portfolio value afterwards
+    def liquidate(self, day):
+        self.day = day
+        self.now = session_time(self.store.dates[day], 1)
+        for asset in list(self.context.portfolio.positions):
+            self.order_target_percent(asset, 0)
+        self.fill_orders()
+        self.now = self.store.dates[day]
+        return self.context.portfolio.portfolio_value
+
+    def mark_to_market(self):
+        portfolio = self.context.portfolio
+        value = 0.0
+        gross = 0.0
+        for asset, position in portfolio.positions.items():
+            price = self.price(asset)
+            if np.isfinite(price):
+                position.last_sale_price = price
+            value += position.amount * position.last_sale_price
+            gross += abs(position.amount * position.last_sale_price)
+        portfolio.positions_value = value
+        portfolio.portfolio_value = portfolio.cash + value
+        self.context.account.leverage = gross / portfolio.portfolio_value if portfolio.portfolio_value else 0.0
+
+    #event loop ------------------------------------------------------------------------------------
+
+    def api(self):
+        return {'symbol': self.symbol,
+                'schedule_function': self.schedule_function,
+                'date_rules': date_rules, 'time_rules': time_rules,
+                'set_slippage': self.set_slippage, 'set_commission': self.set_commission,
+                'slippage': slippage, 'commission': commission,
+                'log': self.log, 'record': self.record, 'get_datetime': self.get_datetime,
+                'order_target_percent': self.order_target_percent,
+                'get_open_orders': lambda *args: {}}
+
+    def timed(self, function, *args):
+        started = time.time()
+        function(*args)
+        if self.pending:
+            self.fill_orders()
+        name = function.__name__
+        self.timings[name] = self.timings.get(name, 0.0) + time.time() - started
+
+    def run(self, algorithm, start=None, end=None):
+        dates = self.store.dates
+        first = dates.searchsorted(pd.Timestamp(start, tz='UTC')) if start else 0
+        last = dates.searchsorted(pd.Timestamp(end, tz='UTC'), side='right') - 1 if end else len(dates) - 1
+        self.day = first
+        self.now = dates[first]
+        self.timed(algorithm.initialize, self.context)
+        events = sorted(self.schedules, key=lambda schedule: schedule.time_rule.order)
+        handle_data = getattr(algorithm, 'handle_data', None)
+        rows = []
+        for day in range(first, last + 1):
+            self.day = day
+            self.now = dates[day]
+            self.mark_to_market()
+            for schedule in events:
+                if schedule.date_rule.matches(dates, day):
+                    self.now = session_time(dates[day], schedule.time_rule.order)
+                    self.timed(schedule.function, self.context, self.data)
+            if handle_data is not None:
+                self.now = session_time(dates[day], 390)
+                self.timed(handle_data, self.context, self.data)
+            self.now = dates[day]
+            self.mark_to_market()
+            portfolio = self.context.portfolio
+            rows.append((self.now, portfolio.portfolio_value, self.context.account.leverage,
+                         len(portfolio.positions)))
+        results = pd.DataFrame(rows, columns=['date', 'portfolio_value', 'leverage', 'positions'])
+        results = results.set_index('date')
+        results['returns'] = results['portfolio_value'].pct_change().fillna(
+            results['portfolio_value'].iloc[0] / self.capital - 1)
+        if self.records:
+            results = results.join(pd.DataFrame.from_dict(self.records, orient='index'), rsuffix='_recorded')
+        return results
+
+
+#UTC timestamp of a minute into the New York session of a (midnight UTC) store date
+def session_time(date, minute):
+    opening = pd.Timestamp(date.date()).tz_localize('US/Eastern') + pd.Timedelta(hours=9, minutes=30)
+    return (opening + pd.Timedelta(minutes=minute)).tz_convert('UTC')
+
+
+#date and time rules ----------------------------------------------------------------------------
+
+class DateRule(object):
+    def __init__(self, matches):
+        self.matches = matches
+
+
+def every_day():
+    return DateRule(lambda dates, day: True)
+
+
+def month_start(days_offset=0):
+    def matches(dates, day):
+        first = day
+        while first > 0 and dates[first - 1].month == dates[day].month:
+            first -= 1
+        return day - first == days_offset
+    return DateRule(matches)
+
+
+def month_end(days_offset=0):
+    def matches(dates, day):
+        last = day
+        while last + 1 < len(dates) and dates[last + 1].month == dates[day].month:
+            last += 1
+        return last - day == days_offset
+    return DateRule(matches)
+
+
+class TimeRule(object):
+    #minutes after the open; a 390-minute session puts close rules at the end of the day
+    def __init__(self, order):
+        self.order = order
+
+
+def market_open(hours=0, minutes=1):
+    return TimeRule(hours * 60 + minutes)
+
+
+def market_close(hours=0, minutes=1):
+    return TimeRule(390 - hours * 60 - minutes)
+
+
+date_rules = types.SimpleNamespace(every_day=every_day, month_start=month_start, month_end=month_end)
+time_rules = types.SimpleNamespace(market_open=market_open, market_close=market_close)
+
+
+class FixedBasisPointsSlippage(object):
+    def __init__(self, basis_points=5, volume_limit=0.1):
+        self.basis_points = basis_points
+
+
+class PerShare(object):
+    def __init__(self, cost=0.001, min_trade_cost=0.0):
+        self.cost = cost
+        self.min_trade_cost = min_trade_cost
+
+
+slippage = types.SimpleNamespace(FixedBasisPointsSlippage=FixedBasisPointsSlippage)
+commission = types.SimpleNamespace(PerShare=PerShare)
+
+
+#install the quantopian.* modules the algorithm imports, bound to one runtime
+def install_modules(runtime):
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+        return mod
+
+    tradable = Term(lambda engine, day: np.isfinite(engine.store.prices[:, day - 1]))
+    industry = ConstantColumn(lambda engine: engine.store.industry_codes)
+    classification = types.SimpleNamespace(morningstar_industry_code=industry)
+    pricing = types.SimpleNamespace(close=BoundColumn('close'), open=BoundColumn('open'))
+
+    module('quantopian')
+    module('quantopian.algorithm', attach_pipeline=runtime.attach_pipeline,
+           pipeline_output=runtime.pipeline_output, order_optimal_portfolio=runtime.order_optimal_portfolio)
+    module('quantopian.optimize', TargetWeights=TargetWeights, MaxGrossExposure=MaxGrossExposure)
+    module('quantopian.pipeline', Pipeline=Pipeline, CustomFactor=CustomFactor)
+    module('quantopian.pipeline.data', Fundamentals=types.SimpleNamespace())
+    module('quantopian.pipeline.data.builtin', USEquityPricing=pricing)
+    module('quantopian.pipeline.filters', QTradableStocksUS=lambda: tradable)
+    module('quantopian.pipeline.classifiers')
+    module('quantopian.pipeline.classifiers.morningstar')
+    module('quantopian.pipeline.data.morningstar', asset_classification=classification)
+
+
+#the algorithm source with every top-level assignment of an overridden constant reading the override
+#instead, so constants derived from it (ADF_LOOKBACK from COINT_LOOKBACK, P_CUTOFF from the RUN_ flags)
+#are computed from the override as the module body runs
+def apply_overrides(tree, overrides):
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id in overrides):
+            value = ast.parse('__overrides__[%r]' % node.targets[0].id, mode='eval').body
+            node.value = ast.copy_location(value, node.value)
+    return ast.fix_missing_locations(tree)
+
+
+#exec the algorithm source as a real module (so worker processes can unpickle its functions);
+#without a runtime it is bound to an empty one, enough to call the screening functions directly
+def load_algorithm(runtime=None, path=ALGORITHM_PATH, name='pair_trading', overrides=None):
+    if runtime is None:
+        runtime = Runtime(None, quiet=True)
+    overrides = overrides or {}
+    install_modules(runtime)
+    algorithm = types.ModuleType(name)
+    algorithm.__file__ = path
+    algorithm.__dict__.update(runtime.api())
+    algorithm.__overrides__ = overrides
+    sys.modules[name] = algorithm
+    with open(path) as f:
+        tree = apply_overrides(ast.parse(f.read(), path), overrides)
+    exec(compile(tree, path, 'exec'), algorithm.__dict__)
+    #names the module body does not assign, or changes after assigning (NUMTESTS)
+    algorithm.__dict__.update(overrides)
+    return algorithm
+
+
+def run_algorithm(store, start=None, end=None, capital=1e6, path=ALGORITHM_PATH, overrides=None, quiet=False):
+    if not isinstance(store, PriceStore):
+        store = PriceStore(store)
+    runtime = Runtime(store, capital=capital, quiet=quiet)
+    algorithm = load_algorithm(runtime, path, overrides=overrides)
+    results = runtime.run(algorithm, start, end)
+    return results, runtime
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run pair_trading.py against a local price store.')
+    parser.add_argument('store')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--capital', type=float, default=1e6)
+    args = parser.parse_args(argv)
+    started = time.time()
+    results, runtime = run_algorithm(args.store, args.start, args.end, args.capital)
+    print(results[['portfolio_value', 'leverage', 'positions']].iloc[::21].to_string())
+    print('orders: %d  commission: %.2f' % (runtime.order_count, runtime.commission_paid))
+    for name, seconds in sorted(runtime.timings.items(), key=lambda item: -item[1]):
+        print('%-24s %8.3fs' % (name, seconds))
+    print('total %.3fs' % (time.time() - started))
+
+
+if __name__ == '__main__':
+    main()
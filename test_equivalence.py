@@ -0,0 +1,251 @@
+#Equivalence of the NumPy statistics in pair_trading.py with the library calls they replaced
+#
+#Each batched test is checked row by row against statsmodels or the original NumPy loop on random
+#walks, cointegrated pairs and mean-reverting spreads, and the rolling hedges against a windowed
+#OLS fit after every bar.
+#
+#   python -m pytest -q test_equivalence.py
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import quantopian_local
+
+sm = pytest.importorskip('statsmodels.tsa.stattools')
+
+algo = quantopian_local.load_algorithm()
+
+
+#[pairs x days] stacks: a random walk leg, a partner cointegrated with it for half of the rows, and
+#their spread, so the p-values land on both sides of the cutoffs
+def make_pairs(num_pairs=12, days=500, seed=0):
+    random = np.random.RandomState(seed)
+    X = 50 + np.cumsum(random.randn(num_pairs, days), axis=1)
+    noise = np.zeros((num_pairs, days))
+    for t in range(1, days):
+        noise[:, t] = 0.8 * noise[:, t - 1] + random.randn(num_pairs)
+    walk = np.cumsum(random.randn(num_pairs, days), axis=1)
+    cointegrated = (np.arange(num_pairs) % 2 == 0)[:, np.newaxis]
+    Y = 1.5 * X + np.where(cointegrated, noise, walk) + 10
+    return Y, X, Y - 1.5 * X
+
+
+#the original Hurst exponent: one std per lag and a polyfit
+def hurst_reference(spreads):
+    lags = range(2, 100)
+    tau = [np.sqrt(np.std(np.subtract(spreads[lag:], spreads[:-lag]))) for lag in lags]
+    poly = np.polyfit(np.log10(lags), np.log10(tau), 1)
+    return poly[0] * 2.0
+
+
+def test_coint_matches_statsmodels():
+    Y, X, _ = make_pairs()
+    pvalues = algo.get_batch_coint_pvalues(Y, X)
+    expected = [sm.coint(y, x)[1] for y, x in zip(Y, X)]
+    np.testing.assert_allclose(pvalues, expected, rtol=1e-6, atol=1e-10)
+
+
+def test_adf_matches_statsmodels():
+    _, _, spreads = make_pairs(seed=1)
+    pvalues = algo.get_adf_pvalue(spreads)
+    expected = [sm.adfuller(spread, 1)[1] for spread in spreads]
+    np.testing.assert_allclose(pvalues, expected, rtol=1e-6, atol=1e-10)
+    assert np.isclose(algo.get_adf_pvalue(spreads[0]), expected[0], rtol=1e-6, atol=1e-10)
+
+
+def test_half_life_matches_ols():
+    _, _, spreads = make_pairs(seed=2)
+    half_lives = algo.get_half_life(spreads)
+    expected = [algo.get_sm_half_life(spread) for spread in spreads]
+    np.testing.assert_allclose(half_lives, expected, rtol=1e-8)
+
+
+def test_hurst_matches_polyfit():
+    _, _, spreads = make_pairs(seed=3)
+    hurst = algo.get_hurst_hvalue(spreads)
+    expected = [hurst_reference(spread) for spread in spreads]
+    np.testing.assert_allclose(hurst, expected, rtol=1e-8, atol=1e-10)
+
+
+def test_rolling_hedges_match_windowed_ols():
+    Y, X, _ = make_pairs(num_pairs=5, days=400, seed=4)
+    window = 60
+    hedges = algo.RollingHedges(Y[:, :window], X[:, :window])
+    for day in range(window, Y.shape[1]):
+        hedges.push(Y[:, day], X[:, day])
+        rows = slice(day - window + 1, day + 1)
+        expected = [np.polyfit(x, y, 1)[0] for y, x in zip(Y[:, rows], X[:, rows])]
+        np.testing.assert_allclose(hedges.beta(), expected, rtol=1e-7)
+
+
+def test_rolling_hedges_settle_and_recover_from_nan():
+    Y, X, _ = make_pairs(num_pairs=3, days=200, seed=5)
+    window = 40
+    Y[1, 70] = np.nan
+    hedges = algo.RollingHedges(Y[:, :window], X[:, :window])
+    for day in range(window, Y.shape[1]):
+        #a forming bar first, then settled to the close
+        hedges.push(Y[:, day] + 1.0, X[:, day] - 1.0)
+        hedges.settle(Y[:, day], X[:, day])
+        rows = slice(day - window + 1, day + 1)
+        expected = np.array([np.polyfit(x, y, 1)[0] if np.isfinite(y).all() else np.nan
+                             for y, x in zip(Y[:, rows], X[:, rows])])
+        np.testing.assert_allclose(hedges.beta(), expected, rtol=1e-7)
+
+
+#statsmodels raised on a constant spread and the pair was counted as a fallback; the NumPy tests
+#return nan there and must be counted the same way, batched or not
+@pytest.mark.parametrize('batched', [True, False])
+def test_singular_spread_counts_as_fallback(batched):
+    days = 800
+    prices = pd.DataFrame({'A': np.linspace(10, 20, days), 'B': np.linspace(5, 10, days),
+                           'C': 10 + np.cumsum(np.random.RandomState(6).randn(days))})
+    candidates = [('A', 'B', {}), ('A', 'C', {})]
+    stats = algo.ScreeningStats()
+    spread_filter = algo.SpreadFilter('adf', 730, algo.get_adf_pvalue, -np.inf, 0.05, batched)
+    spread_filter.apply(prices, candidates, algo.SpreadCache(), stats)
+    assert stats.fallbacks['adf'] == 1
+    assert candidates[0][2]['adf'] == 'N/A'
+    assert np.isfinite(candidates[1][2]['adf'])
+
+
+#rebalances that slide the window by less than PAIR_STATS_MAX_SHIFT reuse far rejections, and
+#accept exactly the pairs a full re-screen accepts. Names on a common factor with their own random
+#walks are correlated but not cointegrated, the rejections the cache holds
+def test_pair_stats_cache_keeps_accepted_set():
+    from bench_screening import make_panel
+    panel = make_panel(40, 900, coint_share=0.5, seed=1)
+    random = np.random.RandomState(8)
+    factor = np.cumsum(random.randn(900))
+    for n in range(20):
+        panel['F%02d' % n] = 100 + 5 * factor + 0.8 * np.cumsum(random.randn(900))
+    pair_stats = algo.PairStatsCache(50000)
+    accepted = 0
+    for end in range(algo.COINT_LOOKBACK + 20, 900, 20):
+        prices = panel.iloc[:end]
+        _, cached = algo.screen_sector(prices, algo.SpreadCache(), algo.ScreeningStats(), None, pair_stats)
+        _, fresh = algo.screen_sector(prices, algo.SpreadCache(), algo.ScreeningStats())
+        assert cached == fresh
+        accepted += len(fresh)
+    assert accepted > 0
+    assert pair_stats.hits > 0
+
+
+#costs are charged on the fill day, so they lower sharpe and can only deepen drawdowns
+def test_sweep_costs_lower_sharpe():
+    import param_sweep
+    Y, X, _ = make_pairs(num_pairs=4, days=600, seed=9)
+    pairs = [('Y%d' % n, 'X%d' % n) for n in range(4)]
+    prices = pd.DataFrame(np.concatenate([Y, X]).T, columns=[y for y, x in pairs] + [x for y, x in pairs])
+    grid = dict(entry=[0.5, 1.0], exit=[0.0, 0.2], z_window=[20], hedge_lookback=[60])
+    free = param_sweep.sweep(prices, pairs, slippage_bps=0.0, algorithm=algo, **grid)
+    costly = param_sweep.sweep(prices, pairs, slippage_bps=500.0, algorithm=algo, **grid)
+    assert (free['trades'] > 0).all()
+    assert (costly['sharpe'] < free['sharpe']).all()
+    assert (costly['max_drawdown'] >= free['max_drawdown']).all()
+    np.testing.assert_allclose(costly['gross_pnl'], free['gross_pnl'])
+    np.testing.assert_allclose(costly['pnl'], costly['gross_pnl'] - costly['commission'] - costly['slippage'])
+
+
+#an override replaces the constant where it is assigned, so the constants derived from it follow
+def test_overrides_reach_derived_constants():
+    overrides = {'COINT_LOOKBACK': 250, 'INTENDED_P': 0.05, 'RUN_SHAPIROWILKE_TEST': False}
+    algorithm = quantopian_local.load_algorithm(overrides=overrides)
+    assert algorithm.ADF_LOOKBACK == algorithm.SCREEN_LOOKBACK == 250
+    assert algorithm.NUMTESTS == 2
+    assert algorithm.COINT_P_MAX == algorithm.SHAPIROWILKE_P_MIN == 0.025
+
+
+#random screening results over few assets, so legs overlap often
+def make_records(random, count, assets):
+    records = []
+    for _ in range(count):
+        y, x = random.choice(assets, 2, replace=False)
+        records.append(algo.PairRecord('S%d' % y, 'S%d' % x, 0, {'coint': random.rand(), 'corr': random.rand(),
+                                                                  'half-life': float(random.randint(10, 16))}))
+    return records
+
+
+#(pairs, total rank score) of the best selection of at most num_pairs records sharing no leg, by
+#trying every combination
+def brute_force_selection(records, stage, num_pairs):
+    best = (-1, 0.0)
+    for count in range(min(num_pairs, len(records)), -1, -1):
+        for combination in itertools.combinations(records, count):
+            legs = [leg for record in combination for leg in (record.y, record.x)]
+            if len(set(legs)) == len(legs):
+                best = max(best, (count, sum(algo.get_rank_score(record, stage) for record in combination)))
+        if best[0] == count:
+            return best
+    return best
+
+
+#greedy takes the best-ranked pairs with no used leg, in rank order; matching finds the brute force
+#optimum, and the branch and bound pruning must not cut it
+@pytest.mark.parametrize('stage', ['coint', 'corr', 'half-life'])
+def test_selection_matches_brute_force(stage):
+    random = np.random.RandomState(10)
+    for trial in range(150):
+        records = make_records(random, random.randint(0, 12), random.randint(2, 10))
+        num_pairs = random.randint(1, 5)
+        expected = []
+        used = set()
+        for record in sorted(records, key=lambda record: -algo.get_rank_score(record, stage)):
+            if len(expected) < num_pairs and record.y not in used and record.x not in used:
+                expected.append((record.y, record.x))
+                used.update((record.y, record.x))
+        greedy = algo.select_greedy(records, stage, num_pairs)
+        assert [(record.y, record.x) for record in greedy.records] == expected
+        matching = algo.select_matching(records, stage, num_pairs)
+        assert len(matching.used) == 2 * len(matching.records)
+        count, total = brute_force_selection(records, stage, num_pairs)
+        assert len(matching.records) == count
+        assert np.isclose(sum(algo.get_rank_score(record, stage) for record in matching.records), total)
+
+
+#rebalances at random gaps on a local store: every cached window equals a fresh data.history, also
+#after a split and a dividend adjust the history of cached stocks
+@pytest.mark.parametrize('threads', [0, 3])
+def test_price_cache_matches_history(tmp_path, threads):
+    random = np.random.RandomState(11)
+    days, names = 700, 30
+    closes = 50 * np.exp(np.cumsum(random.randn(days, names) * 0.01, axis=0))
+    closes[:150, 3] = np.nan
+    closes[400:410, 7] = np.nan
+    symbols = ['S%02d' % n for n in range(names)]
+    panel = pd.DataFrame(closes, index=pd.bdate_range('2012-01-02', periods=days), columns=symbols)
+    codes = dict((symbol, 0) for symbol in symbols)
+    runtime = quantopian_local.Runtime(quantopian_local.PriceStore.write(str(tmp_path / 'store'), panel, codes),
+                                       quiet=True)
+    algorithm = quantopian_local.load_algorithm(runtime, overrides={'PREFETCH_CHUNK': 4})
+    cache = algorithm.PriceCache(25)
+    assets = runtime.store.assets
+
+    def check(day, stocks):
+        runtime.day, runtime.now = day, runtime.store.dates[day]
+        cached = cache.get(runtime.data, stocks, 200, threads)
+        expected = runtime.data.history(stocks, 'price', 200, '1d')
+        assert cached.index.equals(expected.index)
+        assert list(cached.columns) == stocks
+        np.testing.assert_array_equal(cached.values, expected.values)
+
+    day = 250
+    while day < 600:
+        check(day, [assets[n] for n in sorted(random.choice(names, 20, replace=False))])
+        day += random.randint(1, 40)
+    assert cache.hits > 0
+
+    #a 2:1 split and a 1% dividend adjust the whole cached history of two stocks: only those two are
+    #fetched again in full, the others are still updated with the new bars
+    stocks = assets[:20]
+    check(day, stocks)
+    adjusted = panel.copy()
+    adjusted.iloc[:day + 5, 0] *= 0.5
+    adjusted.iloc[:day + 5, 1] *= 0.99
+    runtime.store = quantopian_local.PriceStore.write(str(tmp_path / 'adjusted'), adjusted, codes)
+    hits, misses = cache.hits, cache.misses
+    check(day + 5, stocks)
+    assert (cache.hits - hits, cache.misses - misses) == (18, 2)
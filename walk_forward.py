@@ -0,0 +1,140 @@
+#Walk-forward backtest of pair_trading.py on a local price store, one process per rebalance segment
+#
+#choose_pairs liquidates every position and screens afresh on the INTERVAL schedule, so given its
+#formation window each rebalance period is independent. The history is cut at the rebalance days
+#(the first trading day of every month with month % INTERVAL equal to the first month's), each
+#segment runs the algorithm from its rebalance day to the day before the next one in a worker
+#process, and closes its positions at the next rebalance day's prices exactly as the next
+#choose_pairs would. Segment returns are stitched in order into one equity curve.
+#
+#Every segment starts from the same capital and the curve compounds their returns. Fills round to
+#whole shares and pay the $1 minimum commission, so the stitched curve differs from a single
+#sequential run by those rounding terms only. Days before the first rebalance are flat.
+#
+#   python walk_forward.py STORE --start 2012-01-01 --end 2018-12-31 --processes 4
+#   python walk_forward.py STORE --set INTERVAL=1 --set DESIRED_PAIRS=5
+
+import argparse
+import ast
+import contextlib
+import os
+import multiprocessing
+import sys
+import time
+
+import pandas as pd
+
+import quantopian_local
+
+
+#store day indices of the rebalances between start and end for a given INTERVAL
+def get_rebalance_days(dates, interval, start=None, end=None):
+    first = dates.searchsorted(pd.Timestamp(start, tz='UTC')) if start else 0
+    last = dates.searchsorted(pd.Timestamp(end, tz='UTC'), side='right') - 1 if end else len(dates) - 1
+    month_starts = [day for day in range(first, last + 1) if day == 0 or dates[day - 1].month != dates[day].month]
+    if not month_starts:
+        return [], first, last
+    interval_mod = dates[month_starts[0]].month % interval
+    return [day for day in month_starts if dates[day].month % interval == interval_mod], first, last
+
+
+#(segment number, first day, last day, liquidation day or None) for each rebalance period
+def get_segments(rebalance_days, last):
+    segments = []
+    for n, day in enumerate(rebalance_days):
+        stop = rebalance_days[n + 1] - 1 if n + 1 < len(rebalance_days) else last
+        segments.append((n, day, stop, stop + 1 if n + 1 < len(rebalance_days) else None))
+    return segments
+
+
+#worker: run one segment on its own runtime, returns its daily frame and summary
+def run_segment(task):
+    store_path, (number, first, stop, liquidation), capital, overrides = task
+    store = quantopian_local.PriceStore(store_path)
+    runtime = quantopian_local.Runtime(store, capital=capital, quiet=True)
+    algorithm = quantopian_local.load_algorithm(runtime, overrides=overrides)
+    started = time.time()
+    #the algorithm prints its screening reports, interleaved across workers they are noise
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = runtime.run(algorithm, store.dates[first].strftime('%Y-%m-%d'),
+                              store.dates[stop].strftime('%Y-%m-%d'))
+        carry = 0.0
+        if liquidation is not None:
+            carry = runtime.liquidate(liquidation) / results['portfolio_value'].iloc[-1] - 1
+    results['segment'] = number
+    summary = {'segment': number, 'start': store.dates[first], 'end': store.dates[stop],
+               'return': (1 + results['returns']).prod() * (1 + carry) - 1, 'orders': runtime.order_count,
+               'commission': runtime.commission_paid, 'seconds': time.time() - started,
+               'pairs': [(str(y), str(x)) for y, x in runtime.context.pairs.pairs]}
+    return results, carry, summary
+
+
+#stitch segment frames in order: the closing return of a segment lands on the next segment's first day
+def stitch(outputs, capital, dates, first, last):
+    frames = []
+    carry = 0.0
+    for results, segment_carry, summary in outputs:
+        results = results.copy()
+        results.iloc[0, results.columns.get_loc('returns')] = (
+            (1 + carry) * (1 + results['returns'].iloc[0]) - 1)
+        frames.append(results)
+        carry = segment_carry
+    leading = dates[first:dates.get_loc(frames[0].index[0])] if frames else dates[first:last + 1]
+    flat = pd.DataFrame({'returns': 0.0, 'positions': 0, 'leverage': 0.0, 'segment': -1}, index=leading)
+    stitched = pd.concat([flat] + frames, sort=False)
+    stitched['portfolio_value'] = capital * (1 + stitched['returns']).cumprod()
+    return stitched
+
+
+def walk_forward(store_path, start=None, end=None, capital=1e6, processes=None, overrides=None):
+    store = quantopian_local.PriceStore(store_path)
+    algorithm = quantopian_local.load_algorithm(overrides=overrides)
+    rebalance_days, first, last = get_rebalance_days(store.dates, algorithm.INTERVAL, start, end)
+    segments = get_segments(rebalance_days, last)
+    tasks = [(store_path, segment, capital, overrides) for segment in segments]
+    if processes == 1 or len(tasks) < 2:
+        outputs = [run_segment(task) for task in tasks]
+    else:
+        pool = multiprocessing.get_context('fork').Pool(processes)
+        try:
+            outputs = pool.map(run_segment, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    stitched = stitch(outputs, capital, store.dates, first, last)
+    return stitched, pd.DataFrame([summary for results, carry, summary in outputs]).set_index('segment')
+
+
+def parse_overrides(settings):
+    overrides = {}
+    for setting in settings:
+        name, value = setting.split('=', 1)
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Walk-forward backtest of pair_trading.py in parallel segments.')
+    parser.add_argument('store')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--capital', type=float, default=1e6)
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override an algorithm constant, constants derived from it follow (repeatable)')
+    args = parser.parse_args(argv)
+    started = time.time()
+    stitched, summary = walk_forward(args.store, args.start, args.end, args.capital, args.processes,
+                                     parse_overrides(args.set))
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 60):
+        print(summary.to_string())
+        print(stitched[['portfolio_value', 'returns', 'positions', 'segment']].iloc[::21].to_string())
+    print('final value %.2f  total %.3fs' % (stitched['portfolio_value'].iloc[-1], time.time() - started))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())